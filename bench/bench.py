@@ -0,0 +1,183 @@
+#!/usr/bin/python
+
+# Benchmarks the exporter on synthetic scenes, with a stand-in for bpy instead of blender.
+#
+#   bench/bench.py                                   every preset
+#   bench/bench.py dense skinned                     some of them
+#   bench/bench.py --option "option_format='OSGB'"   with export options
+#   bench/bench.py --save bench.json                 keep the results
+#   bench/bench.py --baseline bench.json             fail when slower or bigger than before
+#
+# Every preset is exported --repeat times into a fresh directory and the fastest
+# run gives the times and throughput. One more run under tracemalloc measures the
+# peak memory, since tracing slows the export down.
+
+import os
+import ast
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import importlib.util
+import contextlib
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "fake"))
+sys.path.insert(0, BENCH_DIR)
+
+import scenes
+
+EXPORTER_PATH = os.path.join(os.path.dirname(BENCH_DIR), "src", "io_export_osg.py")
+
+# arguments of scenes.build_scene
+PRESETS = {
+    "small": dict(objects=3, vertices=2500, materials=2, bones=4, keyframes=25),
+    "many-objects": dict(objects=200, vertices=100, materials=1, bones=0, keyframes=0, textures=0),
+    "dense": dict(objects=1, vertices=40000, materials=4, bones=0, keyframes=0),
+    "skinned": dict(objects=1, vertices=20000, materials=2, bones=32, keyframes=10),
+    "animation": dict(objects=1, vertices=100, materials=1, bones=64, keyframes=200),
+    "textures": dict(objects=4, vertices=400, materials=8, bones=0, keyframes=0, textures=8, texture_size=256),
+    "duplicates": dict(objects=2, vertices=2500, materials=2, bones=0, keyframes=0, duplicates=100),
+    }
+
+# writer functions timed on their own, the outermost call of each
+WRITERS = ("write_scene", "write_mesh", "write_armature", "write_actions")
+
+
+def load_exporter():
+    spec = importlib.util.spec_from_file_location("io_export_osg", EXPORTER_PATH)
+    exporter = importlib.util.module_from_spec(spec)
+    # the serialization processes find their functions through the module name
+    sys.modules[spec.name] = exporter
+    spec.loader.exec_module(exporter)
+    return exporter
+
+
+def time_writers(exporter, writer_times):
+    # replace the writers with versions adding their time to writer_times
+    def timed(name, function):
+        depth = [0]
+
+        def writer(*args):
+            depth[0] += 1
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                depth[0] -= 1
+                if depth[0] == 0:
+                    writer_times[name] = writer_times.get(name, 0.0) + time.time() - start
+        return writer
+
+    for name in WRITERS:
+        setattr(exporter, name, timed(name, getattr(exporter, name)))
+
+
+def export(exporter, preset, options, verbose, trace_memory=False):
+    scenes.build_scene(**PRESETS[preset])
+    directory = tempfile.mkdtemp(prefix="osg-bench-")
+    extension = ".osgb" if options.get("option_format") == 'OSGB' else ".osg"
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(sys.stdout if verbose else output):
+            if trace_memory:
+                tracemalloc.start()
+            start = time.time()
+            exporter.write_osg(None, os.path.join(directory, preset + extension), True, False, True, **options)
+            seconds = time.time() - start
+            peak_memory = 0
+            if trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+    finally:
+        shutil.rmtree(directory, True)
+    return seconds, peak_memory
+
+
+def run_preset(exporter, writer_times, preset, options, repeat, verbose):
+    best = None
+    for i in range(repeat):
+        writer_times.clear()
+        seconds, peak_memory = export(exporter, preset, options, verbose)
+        if best is None or seconds < best["seconds"]:
+            counters = exporter.profile["counters"]
+            best = {
+                "seconds": seconds,
+                "writers": dict(writer_times),
+                "stages": dict(exporter.profile["stages"]),
+                "counters": dict(counters),
+                "vertices_per_second": counters.get("vertices", 0) / seconds,
+                "keys_per_second": counters.get("keys", 0) / seconds,
+                "bytes_per_second": counters.get("bytes_written", 0) / seconds,
+                }
+
+    seconds, best["peak_memory"] = export(exporter, preset, options, verbose, True)
+    return best
+
+
+def compare(results, baseline, tolerance):
+    # presets that got slower or use more memory than the baseline by more than tolerance
+    regressions = []
+    for preset, result in sorted(results.items()):
+        if preset not in baseline:
+            continue
+        for measure in ("seconds", "peak_memory"):
+            before = baseline[preset][measure]
+            if before > 0 and result[measure] > before * (1.0 + tolerance):
+                regressions.append("%s: %s %.4g -> %.4g (%+.0f%%)" % (preset, measure, before, result[measure],
+                                                                    (result[measure] / before - 1.0) * 100.0))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the osg exporter on synthetic scenes.")
+    parser.add_argument("presets", nargs="*", help="presets to run, all of them by default: %s" % ", ".join(sorted(PRESETS)))
+    parser.add_argument("--repeat", type=int, default=3, help="exports per preset, the fastest one counts")
+    parser.add_argument("--option", action="append", default=[], help="export option as name=value, like option_format='OSGB'")
+    parser.add_argument("--save", default=None, help="json file the results are written to")
+    parser.add_argument("--baseline", default=None, help="json file of earlier results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown or memory growth against the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the exporter")
+    args = parser.parse_args()
+
+    options = {}
+    for option in args.option:
+        name, value = option.split("=", 1)
+        options[name] = ast.literal_eval(value)
+
+    presets = args.presets or sorted(PRESETS)
+    exporter = load_exporter()
+    writer_times = {}
+    time_writers(exporter, writer_times)
+    results = {}
+    print("%-14s %9s %9s %9s %9s %9s %11s %9s %8s %9s" % ("preset", "seconds", "scene", "mesh", "armature", "actions",
+                                                       "vertices/s", "keys/s", "MB/s", "peak MB"))
+    for preset in presets:
+        result = run_preset(exporter, writer_times, preset, options, max(args.repeat, 1), args.verbose)
+        results[preset] = result
+        writers = result["writers"]
+        print("%-14s %9.3f %9.3f %9.3f %9.3f %9.3f %11.0f %9.0f %8.2f %9.2f" % (
+            preset, result["seconds"], writers.get("write_scene", 0.0), writers.get("write_mesh", 0.0),
+            writers.get("write_armature", 0.0), writers.get("write_actions", 0.0), result["vertices_per_second"],
+            result["keys_per_second"], result["bytes_per_second"] / 1e6, result["peak_memory"] / 1e6))
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("regression " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+# Minimal stand-in for the parts of the blender 2.5x python api the exporter uses,
+# enough to run it on synthetic scenes outside of blender.
+
+import mathutils
+
+from . import types, props, utils
+
+
+class Collection(list):
+    def foreach_get(self, attr, seq):
+        i = 0
+        for item in self:
+            v = getattr(item, attr)
+            if isinstance(v, (int, float)):
+                seq[i] = v
+                i += 1
+            else:
+                for c in v:
+                    seq[i] = c
+                    i += 1
+
+    @property
+    def active(self):
+        return self[0] if self else None
+
+
+class Data(object):
+    def __init__(self):
+        self.scenes = Collection()
+        self.objects = Collection()
+        self.actions = Collection()
+        self.meshes = MeshCollection()
+
+
+class MeshCollection(Collection):
+    def remove(self, mesh):
+        mesh.removed = True
+        if mesh in self:
+            list.remove(self, mesh)
+
+
+data = Data()
+
+
+class RNAProperty(object):
+    def __init__(self, identifier, value):
+        self.identifier = identifier
+        self.array_length = 0
+        if isinstance(value, bool):
+            self.type = 'BOOLEAN'
+        elif isinstance(value, int):
+            self.type = 'INT'
+        elif isinstance(value, float):
+            self.type = 'FLOAT'
+        elif isinstance(value, str):
+            self.type = 'STRING'
+        elif isinstance(value, (list, tuple, mathutils.Vector)):
+            self.type = 'FLOAT'
+            self.array_length = len(value)
+        else:
+            self.type = 'POINTER'
+
+
+class RNA(object):
+    def __init__(self, struct):
+        self.properties = [RNAProperty('rna_type', None)] + [RNAProperty(k, v) for k, v in sorted(vars(struct).items()) if not k.startswith('_')]
+
+
+class Struct(object):
+    @property
+    def bl_rna(self):
+        return RNA(self)
+
+
+class Group(object):
+    def __init__(self, group, weight):
+        self.group = group
+        self.weight = weight
+
+
+class MeshVertex(object):
+    def __init__(self, co, normal, groups=()):
+        self.co = mathutils.Vector(co)
+        self.normal = mathutils.Vector(normal)
+        self.groups = Collection(groups)
+
+
+class MeshFace(object):
+    def __init__(self, vertices, material_index=0):
+        self.vertices = list(vertices)
+        self.material_index = material_index
+
+    @property
+    def vertices_raw(self):
+        v = list(self.vertices)
+        if len(v) == 3:
+            v.append(0)
+        return v
+
+
+class TextureFace(object):
+    def __init__(self, uv):
+        self.uv = [tuple(u) for u in uv]
+
+    @property
+    def uv_raw(self):
+        r = []
+        for u in self.uv:
+            r.extend(u)
+        if len(self.uv) == 3:
+            r.extend((0.0, 0.0))
+        return r
+
+
+class UVLayer(object):
+    def __init__(self, data):
+        self.data = Collection(data)
+
+
+class Mesh(object):
+    def __init__(self, name, vertices, faces, uv=None):
+        self.name = name
+        self.vertices = Collection(vertices)
+        self.faces = Collection(faces)
+        self.uv_textures = Collection([UVLayer(uv)] if uv is not None else [])
+        self.shape_keys = None
+        self.removed = False
+        self.users = 0
+
+
+class Image(object):
+    def __init__(self, name, filepath, size=(4, 4)):
+        self.name = name
+        self.filepath = filepath
+        self.size = list(size)
+        self.has_data = True
+        self.pixels = [(i % 251) / 250.0 for i in range(size[0] * size[1] * 4)]
+
+    def save_render(self, filename, scene):
+        with open(filename, 'wb') as f:
+            f.write(b'PNG')
+
+
+class Texture(object):
+    def __init__(self, image):
+        self.type = 'IMAGE'
+        self.image = image
+        self.repeat_x = 1
+        self.repeat_y = 2
+
+
+class Material(Struct):
+    def __init__(self, name, texture=None):
+        self.name = name
+        self.alpha = 1.0
+        self.ambient = 0.5
+        self.diffuse_color = mathutils.Vector((0.8, 0.2, 0.1))
+        self.diffuse_intensity = 0.8
+        self.use_object_color = False
+        self.emit = 0.0
+        self.specular_hardness = 50
+        self.active_texture = texture
+
+
+class MaterialSlot(object):
+    def __init__(self, material):
+        self.material = material
+        self.name = material.name
+
+
+class VertexGroup(object):
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+class Modifier(Struct):
+    def __init__(self, type, object=None):
+        self.type = type
+        self.object = object
+        self.name = type.title()
+        self.show_render = True
+
+
+class Bone(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class PoseBone(object):
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.bone = Bone(name)
+        self.parent = parent
+        self.children = []
+        if parent:
+            parent.children.append(self)
+        self.matrix = mathutils.Matrix.Translation((0, 0, 1))
+        self.rotation_mode = 'QUATERNION'
+        self.rotation_quaternion = mathutils.Quaternion()
+
+    @property
+    def children_recursive(self):
+        r = []
+        for c in self.children:
+            r.append(c)
+            r.extend(c.children_recursive)
+        return r
+
+
+class Pose(object):
+    def __init__(self, bones):
+        self.bones = Collection(bones)
+
+
+class Armature(object):
+    def __init__(self, name):
+        self.name = name
+        self.pose_position = 'POSE'
+
+
+class Object(object):
+    def __init__(self, name, type, data=None):
+        self.name = name
+        self.type = type
+        self.data = data
+        self.modifiers = Collection()
+        self.parent = None
+        self.parent_type = 'OBJECT'
+        self.parent_bone = ''
+        self.matrix_local = mathutils.Matrix()
+        self.matrix_world = mathutils.Matrix()
+        self.material_slots = Collection()
+        self.color = [1.0, 1.0, 1.0, 1.0]
+        self.vertex_groups = Collection()
+        self.pose = None
+        self.location = mathutils.Vector((1, 2, 3))
+        self.rotation_euler = mathutils.Euler((0.1, 0.2, 0.3))
+
+    def to_mesh(self, scene, apply_modifiers, settings):
+        src = self.data
+        m = Mesh(src.name, [MeshVertex(v.co, v.normal, v.groups) for v in src.vertices],
+                 [MeshFace(f.vertices, f.material_index) for f in src.faces],
+                 [TextureFace(t.uv) for t in src.uv_textures.active.data] if src.uv_textures else None)
+        data.meshes.append(m)
+        return m
+
+
+class Lamp(object):
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+        self.use_diffuse = True
+        self.use_specular = True
+        self.color = [1.0, 0.9, 0.8]
+        self.distance = 25.0
+        self.linear_attenuation = 0.1
+        self.quadratic_attenuation = 0.01
+        self.spot_blend = 0.15
+        self.spot_size = 0.8
+
+
+class ObjectBase(object):
+    def __init__(self, obj, select=True):
+        self.object = obj
+        self.select = select
+
+
+class World(object):
+    ambient_color = [0.1, 0.1, 0.1]
+
+
+class Render(object):
+    fps = 24
+    file_format = 'JPEG'
+
+
+class Scene(object):
+    def __init__(self, name):
+        self.name = name
+        self.objects = Collection()
+        self.object_bases = Collection()
+        self.world = World()
+        self.render = Render()
+
+    def link(self, obj, select=True):
+        self.objects.append(obj)
+        self.object_bases.append(ObjectBase(obj, select))
+        data.objects.append(obj)
+
+
+class Keyframe(object):
+    def __init__(self, frame, value):
+        self.co = (float(frame), float(value))
+
+
+class FCurve(object):
+    def __init__(self, data_path, array_index, keys):
+        self.data_path = data_path
+        self.array_index = array_index
+        self.keyframe_points = Collection(Keyframe(f, v) for f, v in keys)
+
+    def evaluate(self, frame):
+        pts = [k.co for k in self.keyframe_points]
+        if frame <= pts[0][0]:
+            return pts[0][1]
+        for (f0, v0), (f1, v1) in zip(pts, pts[1:]):
+            if f0 <= frame <= f1:
+                return v0 + (v1 - v0) * (frame - f0) / (f1 - f0)
+        return pts[-1][1]
+
+
+class Action(object):
+    def __init__(self, name):
+        self.name = name
+        self.fcurves = Collection()
+        self.frame_range = (1.0, 1.0)
+
+
+def reset():
+    global data
+    data = Data()
+    return data
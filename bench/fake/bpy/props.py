@@ -0,0 +1,8 @@
+# the properties of an operator are plain class attributes holding their default
+
+
+def Property(**options):
+    return options.get('default')
+
+
+StringProperty = BoolProperty = EnumProperty = FloatProperty = IntProperty = Property
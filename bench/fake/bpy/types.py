@@ -0,0 +1,11 @@
+class Operator(object):
+    pass
+
+
+class Menu(list):
+    def remove(self, function):
+        if function in self:
+            list.remove(self, function)
+
+
+INFO_MT_file_export = Menu()
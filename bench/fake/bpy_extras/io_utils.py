@@ -0,0 +1,2 @@
+class ExportHelper(object):
+    filepath = ''
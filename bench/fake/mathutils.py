@@ -0,0 +1,150 @@
+# Pure Python stand-in for the parts of blender's mathutils the exporter uses.
+
+import math
+
+
+class Vector(object):
+    def __init__(self, seq=(0.0, 0.0, 0.0)):
+        self._v = [float(c) for c in seq]
+
+    def __getitem__(self, i):
+        return self._v[i]
+
+    def __setitem__(self, i, v):
+        self._v[i] = v
+
+    def __len__(self):
+        return len(self._v)
+
+    def __iter__(self):
+        return iter(self._v)
+
+    def normalize(self):
+        length = math.sqrt(sum(c * c for c in self._v))
+        if length > 0:
+            self._v = [c / length for c in self._v]
+
+    def rotate(self, rotation):
+        m = rotation.to_matrix()
+        v = self._v
+        self._v = [sum(m[i][j] * v[j] for j in range(3)) for i in range(3)]
+
+    x = property(lambda self: self._v[0])
+    y = property(lambda self: self._v[1])
+    z = property(lambda self: self._v[2])
+
+
+class Matrix(object):
+    def __init__(self, rows=None):
+        if rows is None:
+            rows = [[1.0 if i == j else 0.0 for j in range(4)] for i in range(4)]
+        self._r = [[float(c) for c in row] for row in rows]
+
+    def __getitem__(self, i):
+        return self._r[i]
+
+    def __len__(self):
+        return len(self._r)
+
+    def __iter__(self):
+        return iter(self._r)
+
+    def identity(self):
+        n = len(self._r)
+        self._r = [[1.0 if i == j else 0.0 for j in range(n)] for i in range(n)]
+
+    def copy(self):
+        return Matrix(self._r)
+
+    def to_4x4(self):
+        m = Matrix()
+        for i in range(len(self._r)):
+            for j in range(len(self._r)):
+                m._r[i][j] = self._r[i][j]
+        return m
+
+    def inverted(self):
+        n = len(self._r)
+        a = [list(row) + [1.0 if i == j else 0.0 for j in range(n)] for i, row in enumerate(self._r)]
+        for c in range(n):
+            p = max(range(c, n), key=lambda r: abs(a[r][c]))
+            a[c], a[p] = a[p], a[c]
+            d = a[c][c]
+            if abs(d) < 1e-12:
+                return Matrix()
+            a[c] = [x / d for x in a[c]]
+            for r in range(n):
+                if r != c:
+                    f = a[r][c]
+                    a[r] = [x - f * y for x, y in zip(a[r], a[c])]
+        return Matrix([row[n:] for row in a])
+
+    def __mul__(self, other):
+        n = len(self._r)
+        return Matrix([[sum(self._r[i][k] * other._r[k][j] for k in range(n)) for j in range(n)] for i in range(n)])
+
+    @staticmethod
+    def Rotation(angle, size, axis):
+        c, s = math.cos(angle), math.sin(angle)
+        if axis == 'X':
+            rows = [[1, 0, 0], [0, c, -s], [0, s, c]]
+        elif axis == 'Y':
+            rows = [[c, 0, s], [0, 1, 0], [-s, 0, c]]
+        else:
+            rows = [[c, -s, 0], [s, c, 0], [0, 0, 1]]
+        m = Matrix(rows)
+        return m.to_4x4() if size == 4 else m
+
+    @staticmethod
+    def Translation(v):
+        m = Matrix()
+        for i in range(3):
+            m._r[i][3] = v[i]
+        return m
+
+
+class Quaternion(object):
+    def __init__(self, seq=(1.0, 0.0, 0.0, 0.0)):
+        self.w, self.x, self.y, self.z = [float(c) for c in seq]
+
+    def __mul__(self, o):
+        return Quaternion((
+            self.w * o.w - self.x * o.x - self.y * o.y - self.z * o.z,
+            self.w * o.x + self.x * o.w + self.y * o.z - self.z * o.y,
+            self.w * o.y - self.x * o.z + self.y * o.w + self.z * o.x,
+            self.w * o.z + self.x * o.y - self.y * o.x + self.z * o.w))
+
+    def to_euler(self, order='XYZ'):
+        w, x, y, z = self.w, self.x, self.y, self.z
+        ex = math.atan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+        ey = math.asin(max(-1.0, min(1.0, 2 * (w * y - z * x))))
+        ez = math.atan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+        return Euler((ex, ey, ez), 'XYZ')
+
+    def to_matrix(self):
+        w, x, y, z = self.w, self.x, self.y, self.z
+        return Matrix([
+            [1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)],
+            [2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)],
+            [2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)]])
+
+
+class Euler(object):
+    def __init__(self, angles=(0.0, 0.0, 0.0), order='XYZ'):
+        self.x, self.y, self.z = [float(a) for a in angles]
+        self.order = order
+
+    def __getitem__(self, i):
+        return (self.x, self.y, self.z)[i]
+
+    def to_quaternion(self):
+        axes = {'X': (self.x, (1, 0, 0)), 'Y': (self.y, (0, 1, 0)), 'Z': (self.z, (0, 0, 1))}
+        q = Quaternion()
+        for axis in self.order:
+            angle, v = axes[axis]
+            s = math.sin(angle / 2)
+            q = Quaternion((math.cos(angle / 2), v[0] * s, v[1] * s, v[2] * s)) * q
+        return q
+
+    def to_matrix(self):
+        return self.to_quaternion().to_matrix()
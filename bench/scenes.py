@@ -0,0 +1,121 @@
+# Synthetic scenes for the benchmarks, built from the fake bpy module.
+#
+# build_scene() fills bpy.data with one scene holding
+#  - an armature with a chain of bones, animated by one action
+#  - grid meshes, the first one skinned to the armature, every other one
+#    parented to the previous mesh or to a bone
+#  - linked duplicates of the second mesh
+#  - one lamp of each type
+# Everything is derived from the arguments, so a scene is the same on every run.
+
+import math
+
+import bpy
+import mathutils
+
+
+def grid_mesh(name, size, materials, groups):
+    # size x size quads, every third one split into two triangles
+    vertices = []
+    for j in range(size + 1):
+        for i in range(size + 1):
+            weights = []
+            if groups:
+                weights.append(bpy.Group(i % groups, 0.75))
+                weights.append(bpy.Group((i + 1) % groups, 0.25))
+            vertices.append(bpy.MeshVertex((i, j, math.sin(i * 0.3) * math.cos(j * 0.2)), (0, 0, 1), weights))
+
+    faces = []
+    uvs = []
+    for j in range(size):
+        for i in range(size):
+            a = j * (size + 1) + i
+            b, c, d = a + 1, a + size + 2, a + size + 1
+            u0, v0, u1, v1 = float(i) / size, float(j) / size, float(i + 1) / size, float(j + 1) / size
+            material_index = (i + j) % materials
+            if (i + j) % 3 == 0:
+                faces.append(bpy.MeshFace((a, b, c), material_index))
+                uvs.append(bpy.TextureFace([(u0, v0), (u1, v0), (u1, v1)]))
+                faces.append(bpy.MeshFace((a, c, d), material_index))
+                uvs.append(bpy.TextureFace([(u0, v0), (u1, v1), (u0, v1)]))
+            else:
+                faces.append(bpy.MeshFace((a, b, c, d), material_index))
+                uvs.append(bpy.TextureFace([(u0, v0), (u1, v0), (u1, v1), (u0, v1)]))
+    return bpy.Mesh(name, vertices, faces, uvs)
+
+
+def build_action(pose_bones, keyframes):
+    action = bpy.Action("Action")
+    for pose_bone in pose_bones:
+        path = 'pose.bones["%s"]' % pose_bone.name
+        for i in range(3):
+            action.fcurves.append(bpy.FCurve(path + ".location", i, [(f * 2 + 1, 0.1 * math.sin(f * 0.5 + i)) for f in range(keyframes)]))
+            action.fcurves.append(bpy.FCurve(path + ".scale", i, [(f * 2 + 1, 1.0) for f in range(keyframes)]))
+        if pose_bone.rotation_mode == 'QUATERNION':
+            for i in range(4):
+                action.fcurves.append(bpy.FCurve(path + ".rotation_quaternion", i, [(f * 2 + 1, 1.0 if i == 0 else 0.1 * math.sin(f * 0.3)) for f in range(keyframes)]))
+        else:
+            for i in range(3):
+                action.fcurves.append(bpy.FCurve(path + ".rotation_euler", i, [(f * 2 + 1, 0.2 * math.sin(f * 0.4 + i)) for f in range(keyframes)]))
+    action.frame_range = (1.0, keyframes * 2 - 1.0)
+    return action
+
+
+def build_scene(objects=3, vertices=2500, materials=2, bones=4, keyframes=25, textures=1, texture_size=64, duplicates=0):
+    bpy.reset()
+    scene = bpy.Scene("Scene")
+    bpy.data.scenes.append(scene)
+
+    images = [bpy.Image("Image%d" % i, "//textures/image%d.png" % i, (texture_size, texture_size)) for i in range(textures)]
+    scene_materials = []
+    for i in range(materials):
+        texture = bpy.Texture(images[i % textures]) if textures and i < textures else None
+        scene_materials.append(bpy.Material("Material%d" % i, texture))
+
+    armature = None
+    pose_bones = []
+    if bones:
+        armature = bpy.Object("Armature", 'ARMATURE', bpy.Armature("ArmatureData"))
+        for i in range(bones):
+            pose_bone = bpy.PoseBone("Bone%d" % i, pose_bones[-1] if pose_bones else None)
+            if i % 2:
+                pose_bone.rotation_mode = 'XYZ'
+            pose_bones.append(pose_bone)
+        armature.pose = bpy.Pose(pose_bones)
+        scene.link(armature)
+
+    size = max(1, int(round(math.sqrt(vertices))) - 1)
+    meshes = []
+    for i in range(objects):
+        skinned = i == 0 and armature != None
+        o = bpy.Object("Mesh%d" % i, 'MESH', grid_mesh("MeshData%d" % i, size, materials, bones if skinned else 0))
+        for material in scene_materials:
+            o.material_slots.append(bpy.MaterialSlot(material))
+        if skinned:
+            o.modifiers.append(bpy.Modifier("ARMATURE", armature))
+            for b in range(bones):
+                o.vertex_groups.append(bpy.VertexGroup("Bone%d" % b, b))
+        elif i % 3 == 1 and meshes:
+            o.parent = meshes[-1]
+        elif i % 3 == 2 and armature != None:
+            o.parent = armature
+            o.parent_type = 'BONE'
+            o.parent_bone = pose_bones[i % bones].name
+        o.matrix_local = mathutils.Matrix.Translation((i, 0, 0))
+        scene.link(o)
+        meshes.append(o)
+
+    for i in range(duplicates):
+        o = bpy.Object("Duplicate%d" % i, 'MESH', meshes[min(1, len(meshes) - 1)].data)
+        for material in scene_materials:
+            o.material_slots.append(bpy.MaterialSlot(material))
+        o.matrix_local = mathutils.Matrix.Translation((0, i + 1, 0))
+        scene.link(o)
+
+    for lamp_type in ('POINT', 'SPOT', 'HEMI'):
+        scene.link(bpy.Object("Lamp" + lamp_type.title(), 'LAMP', bpy.Lamp(lamp_type, lamp_type)))
+
+    if armature != None and keyframes:
+        bpy.data.actions.append(build_action(pose_bones, keyframes))
+
+    return scene
@@ -5,7 +5,7 @@ bl_info = {
     "blender": (2, 5, 8),
     "api": 37702,
     "location": "File > Export > OpenSceneGraph (.osg)",
-    "description": "Export OSG Model Format (.osg)",
+    "description": "Export OSG Model Format (.osg, .osgb)",
     "warning": "Unstable!",
     "wiki_url": "http://code.google.com/p/blender-osgexport-25/wiki",
     "tracker_url": "http://code.google.com/p/blender-osgexport-25/issues/",
@@ -15,338 +15,2289 @@ import bpy
 import os
 import re
 import sys
+import json
 import math
+import time
+import array
+import hashlib
+import multiprocessing
+import concurrent.futures
+import zlib
+import struct
+import pickle
+import tempfile
 import mathutils
 
-def print_indent():
-    global indent_level, export_file
-    for i in range(indent_level):
-        export_file.write("  ")
-        
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# highest vertex index a DrawElementsUShort can address
+USHORT_INDEX_LIMIT = 65535
+
+# number of entries in the post-transform vertex cache the index order is optimized for
+VERTEX_CACHE_SIZE = 32
+
+# values of bone channel components that are not animated
+CHANNEL_REST_VALUES = {
+    'location': (0.0, 0.0, 0.0),
+    'scale': (1.0, 1.0, 1.0),
+    'rotation_euler': (0.0, 0.0, 0.0),
+    'rotation_quaternion': (1.0, 0.0, 0.0, 0.0),
+    }
+
+# file next to the exported model that remembers the content of the textures it wrote there,
+# one per exported file so exports into the same directory do not share it
+TEXTURE_CACHE_SUFFIX = ".textures.json"
+
+# directory next to the exported model holding its serialized Geodes for incremental export,
+# and the version of their layout
+FRAGMENT_CACHE_SUFFIX = ".fragments"
+FRAGMENT_CACHE_VERSION = 1
+
+# number of pixel values copied out of blender at a time
+PIXEL_SLICE = 1 << 20
+
+# Geodes with fewer rows are formatted right away instead of in a serialization process
+SERIALIZE_MIN_ROWS = 4096
+
+# file extension of the text format for each compression method
+COMPRESSED_EXTENSIONS = {
+    'GZIP': ".osgz",
+    'ZSTD': ".osg.zst",
+    'LZ4': ".osg.lz4",
+    }
+
+class OSGEmitter(object):
+    '''Buffered writer for the indented osg text format'''
+
+    def __init__(self, output, buffer_size=1 << 20):
+        self.output = output
+        self.buffer_size = buffer_size
+        self.indent_level = 0
+        # cached indentation prefix per level
+        self.prefixes = [""]
+        # text and serialization jobs in written order, the bytes of the text and the number of jobs
+        self.chunks = []
+        self.buffered = 0
+        self.jobs = 0
+        self.fragment_state = None
+
+    def prefix(self):
+        while len(self.prefixes) <= self.indent_level:
+            self.prefixes.append("  " * len(self.prefixes))
+        return self.prefixes[self.indent_level]
+
+    def write(self, s):
+        self.chunks.append(s)
+        self.buffered += len(s)
+        if self.buffered >= self.buffer_size and self.fragment_state is None:
+            # text piling up behind a running job waits for it past twice the buffer
+            self.flush_ready(self.buffered >= 2 * self.buffer_size)
+
+    def write_deferred(self, job, max_jobs):
+        # Text of a job still being formatted, it is written in place once done. Running
+        # jobs do not count against the buffer, beyond max_jobs the oldest is waited for.
+        self.chunks.append(job)
+        self.jobs += 1
+        if self.jobs > max_jobs and self.fragment_state is None:
+            self.flush_ready(True)
+
+    def flush_ready(self, wait=False):
+        # write the text up to the first job still running, wait for that one first if asked to
+        ready = []
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                self.buffered -= len(chunk)
+            elif chunk.done() or wait:
+                chunk = chunk.result()
+                self.jobs -= 1
+                wait = False
+            else:
+                break
+            ready.append(chunk)
+        if ready:
+            self.chunks = self.chunks[len(ready):]
+            self.output.write("".join(ready))
+
+    def text(self):
+        return "".join([chunk if isinstance(chunk, str) else chunk.result() for chunk in self.chunks])
+
+    def write_indented(self, s):
+        self.write(self.prefix() + s + "\n")
+
+    def write_lines(self, lines):
+        # write a block of lines at the current indentation
+        if len(lines) == 0:
+            return
+        prefix = self.prefix()
+        self.write(prefix + ("\n" + prefix).join(lines) + "\n")
+
+    def write_rows(self, line_format, rows):
+        # write one line per row of a numeric array with a single format call
+        if len(rows) == 0:
+            return
+        if numpy != None and isinstance(rows, numpy.ndarray):
+            values = rows.ravel().tolist()
+        else:
+            values = [value for row in rows for value in row]
+        self.write(((self.prefix() + line_format + "\n") * len(rows)) % tuple(values))
+
+    def open_class(self, name):
+        self.write(self.prefix() + name + " {\n")
+        self.indent_level += 1
+
+    def close_class(self):
+        self.indent_level -= 1
+        self.write(self.prefix() + "}\n")
+
+    def flush(self):
+        self.output.write(self.text())
+        self.chunks = []
+        self.buffered = 0
+        self.jobs = 0
+
+    def begin_fragment(self):
+        # keep what is written until end_fragment apart, without indentation
+        self.fragment_state = (self.chunks, self.buffered, self.jobs, self.indent_level)
+        self.chunks = []
+        self.buffered = 0
+        self.jobs = 0
+        self.indent_level = 0
+
+    def end_fragment(self):
+        fragment = self.text()
+        self.chunks, self.buffered, self.jobs, self.indent_level = self.fragment_state
+        self.fragment_state = None
+        self.write_fragment(fragment)
+        return fragment
+
+    def write_fragment(self, fragment, remap=None):
+        # write a fragment at the current indentation, remap rewrites its UniqueIDs
+        if remap != None:
+            fragment = remap(fragment)
+        prefix = self.prefix()
+        if prefix and fragment:
+            fragment = prefix + fragment[:-1].replace("\n", "\n" + prefix) + "\n"
+        self.write(fragment)
+
+    def close(self):
+        self.flush()
+        self.output.close()
+
+class OSGRecorder(object):
+    '''Records the emitter calls of a block as plain data, to be formatted elsewhere'''
+
+    def __init__(self):
+        self.ops = []
+        self.rows = 0
+
+    def write_indented(self, s):
+        self.ops.append(("write_indented", s))
+
+    def write_lines(self, lines):
+        self.ops.append(("write_lines", list(lines)))
+
+    def write_rows(self, line_format, rows):
+        if numpy is None or not isinstance(rows, numpy.ndarray):
+            rows = [tuple(row) for row in rows]
+        self.rows += len(rows)
+        self.ops.append(("write_rows", line_format, rows))
+
+    def open_class(self, name):
+        self.ops.append(("open_class", name))
+
+    def close_class(self):
+        self.ops.append(("close_class",))
+
+    def replay(self, target):
+        for op in self.ops:
+            getattr(target, op[0])(*op[1:])
+
+def format_ops(ops, indent_level):
+    # runs in a serialization process: the text of recorded emitter calls
+    formatter = OSGEmitter(None, sys.maxsize)
+    formatter.indent_level = indent_level
+    recorder = OSGRecorder()
+    recorder.ops = ops
+    recorder.replay(formatter)
+    return formatter.text()
+
+class CompressedOutput(object):
+    '''File like output that compresses everything written to it on the fly'''
+
+    def __init__(self, path, method='GZIP', level=6):
+        if method == 'ZSTD' and zstandard is None or method == 'LZ4' and lz4 is None:
+            print("Warning: %s compression is not available, using gzip." % method.lower())
+            method = 'GZIP'
+        if method == 'ZSTD':
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        elif method == 'LZ4':
+            self.compressor = lz4.frame.LZ4FrameCompressor()
+        else:
+            # wbits 31 writes a gzip header, which the osgdb gz plugin reads as .osgz
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self.method = method
+        self.output = open(path, 'wb')
+        self.raw_size = 0
+        self.compressed_size = 0
+        self.compress_time = 0.0
+        if method == 'LZ4':
+            self.write_compressed(self.compressor.begin())
+
+    def write_compressed(self, data):
+        self.compressed_size += len(data)
+        self.output.write(data)
+
+    def write(self, s):
+        if not isinstance(s, bytes):
+            s = s.encode("utf-8")
+        self.raw_size += len(s)
+        start = time.time()
+        data = self.compressor.compress(s)
+        self.compress_time += time.time() - start
+        if data:
+            self.write_compressed(data)
+
+    def close(self):
+        start = time.time()
+        data = self.compressor.flush()
+        self.compress_time += time.time() - start
+        self.write_compressed(data)
+        self.output.close()
+        print("%s compression: %d -> %d bytes, ratio %.2f, %.2f seconds" % (self.method.lower(), self.raw_size, self.compressed_size,
+                                                                            float(self.raw_size) / max(self.compressed_size, 1), self.compress_time))
+
+def start_profile():
+    # wall time per export stage, and per object or action, and the counters of the export
+    global profile, profile_start
+    profile_start = time.time()
+    profile = {"stages": {}, "counters": {}, "objects": {}, "actions": {}}
+
+def add_time(stage, start, name=None, items="objects"):
+    # adds the time since start to stage, and to the stage of the object or action name
+    seconds = time.time() - start
+    profile["stages"][stage] = profile["stages"].get(stage, 0.0) + seconds
+    if name != None:
+        item = profile[items].setdefault(name, {})
+        item[stage] = item.get(stage, 0.0) + seconds
+
+def add_count(counter, count, name=None, items="objects"):
+    profile["counters"][counter] = profile["counters"].get(counter, 0) + count
+    if name != None:
+        item = profile[items].setdefault(name, {})
+        item[counter] = item.get(counter, 0) + count
+
+def peak_memory():
+    # peak resident set size of the process in bytes, None where it is not known
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but on mac os
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def write_profile(path):
+    profile["file"] = filepath
+    profile["seconds"] = time.time() - profile_start
+    try:
+        with open(path, 'w') as profile_file:
+            json.dump(profile, profile_file, indent=1, sort_keys=True)
+        print("profile written to %s" % path)
+    except IOError:
+        print("Warning: could not write the profile %s" % path)
+
 def write_indented(s):
-    global export_file
-    print_indent()
-    export_file.write(s)
-    export_file.write("\n")
+    emitter.write_indented(s)
 
 def open_class(name):
-    global export_file, indent_level
-    print_indent()
-    export_file.write(name)
-    export_file.write(" {\n")
-    indent_level += 1
-    
+    emitter.open_class(name)
+
 def close_class():
-    global export_file, indent_level
-    indent_level -= 1
-    print_indent()
-    export_file.write("}\n")
+    emitter.close_class()
+
+def write_rows(line_format, rows):
+    start = time.time()
+    emitter.write_rows(line_format, rows)
+    add_time("serialization", start)
+
+def write_matrix_rows(m):
+    emitter.write_rows("%f %f %f %f", [m[0], m[1], m[2], m[3]])
+
+# header of the native binary format as written by the osgDB serializers of
+# OpenSceneGraph 3.0, which later releases still read
+OSGB_HEADER_LOW = 0x6C910EA1
+OSGB_HEADER_HIGH = 0x1AFB4545
+OSGB_READ_SCENE = 1
+OSGB_VERSION = 80
+
+OSGB_GL_ENUMS = {
+    "GL_BLEND": 0x0BE2,
+    "GL_TEXTURE_2D": 0x0DE1,
+    "CLAMP": 0x2900,
+    "REPEAT": 0x2901,
+    "CLAMP_TO_EDGE": 0x812F,
+    "NEAREST": 0x2600,
+    "LINEAR": 0x2601,
+    "LINEAR_MIPMAP_LINEAR": 0x2703,
+    "TRIANGLES": 0x0004,
+    "TRIANGLE_STRIP": 0x0005,
+    "QUADS": 0x0007,
+    }
+
+# array type id and number of components
+OSGB_ARRAY_TYPES = {
+    "Vec2Array": (15, 2),
+    "Vec3Array": (16, 3),
+    }
+
+# primitive type id and struct format of one index
+OSGB_PRIMITIVE_TYPES = {
+    "DrawElementsUShort": (53, 'H'),
+    "DrawElementsUInt": (54, 'I'),
+    }
+
+OSGB_RENDERING_HINTS = {
+    "DEFAULT_BIN": (0, 0, 0, ""),
+    "OPAQUE_BIN": (1, 1, 0, "RenderBin"),
+    "TRANSPARENT_BIN": (2, 1, 10, "DepthSortedBin"),
+    }
+
+# struct format of one key (time and value) and the number of values it holds
+OSGB_CHANNEL_KEYS = {
+    "Vec3LinearChannel": ("d3f", 4),
+    "QuatSphericalLinearChannel": ("d4d", 5),
+    }
+
+OSGB_NUMPY_TYPES = {'f': '<f4', 'd': '<f8', 'H': '<u2', 'I': '<u4', 'i': '<i4'}
+
+IDENTITY_MATRIX = (1.0, 0.0, 0.0, 0.0,
+                   0.0, 1.0, 0.0, 0.0,
+                   0.0, 0.0, 1.0, 0.0,
+                   0.0, 0.0, 0.0, 1.0)
+
+class OSGBlock(object):
+    '''One class block of the osg text format, kept for the binary writer'''
+    __slots__ = ("header", "entries")
+
+    def __init__(self, header):
+        self.header = header
+        # lines, nested blocks and (line_format, rows) tuples in written order
+        self.entries = []
+
+    def class_name(self):
+        return self.header.split(None, 1)[0]
+
+    def blocks(self, names=None):
+        return [entry for entry in self.entries if isinstance(entry, OSGBlock) and (names is None or entry.class_name() in names)]
+
+    def block(self, name):
+        for entry in self.entries:
+            if isinstance(entry, OSGBlock) and entry.class_name() == name:
+                return entry
+        return None
+
+    def find(self, keyword):
+        # first line or block starting with keyword, as a list of tokens
+        for entry in self.entries:
+            if isinstance(entry, OSGBlock):
+                tokens = entry.header.split()
+            elif isinstance(entry, str):
+                tokens = entry.split()
+            else:
+                continue
+            if tokens and tokens[0] == keyword:
+                return entry, tokens
+        return None, None
+
+    def field(self, keyword, default=None):
+        entry, tokens = self.find(keyword)
+        if entry is None or isinstance(entry, OSGBlock):
+            return default
+        return entry.split(None, 1)[1] if len(tokens) > 1 else ""
+
+    def floats(self, keyword, default):
+        value = self.field(keyword)
+        if value is None:
+            return default
+        return [float(token) for token in value.split()]
+
+    def name(self):
+        value = self.field("name", "\"\"")
+        return value[1:-1]
+
+    def values(self):
+        # all numbers of the block body, as a numpy array when it holds a single one
+        values = []
+        for entry in self.entries:
+            if isinstance(entry, tuple):
+                rows = entry[1]
+                if numpy is not None and isinstance(rows, numpy.ndarray):
+                    if len(self.entries) == 1:
+                        return rows.ravel()
+                    values.extend(rows.ravel().tolist())
+                else:
+                    for row in rows:
+                        values.extend(row)
+            elif isinstance(entry, str):
+                values.extend([int(token) if token.isdigit() else float(token) for token in entry.split()])
+        return values
+
+class OSGBinaryEmitter(object):
+    '''Collects the class blocks of the osg text format and writes them as native binary osgb'''
+
+    def __init__(self, output, buffer_size=1<<20, spool=None):
+        self.output = output
+        self.buffer_size = buffer_size
+        self.chunks = []
+        self.buffered = 0
+        self.root = OSGBlock("")
+        self.stack = [self.root]
+        self.object_ids = {}
+        self.object_count = 0
+        self.array_ids = {}
+        # blocks by the UniqueID of their first line
+        self.shared_blocks = {}
+        # With a spool file every Geode is serialized into it when it is closed, and
+        # only its offset and size are kept instead of its blocks until close
+        self.spool = spool
+        self.spooled = {}
+
+    # the same interface the text emitter offers to the scene traversal
+
+    def write_indented(self, s):
+        tokens = s.split(None, 2)
+        if len(tokens) == 2 and tokens[0] == "UniqueID":
+            self.shared_blocks[tokens[1]] = self.stack[-1]
+        elif len(tokens) == 2 and tokens[0] == "Use" and tokens[1] in self.shared_blocks:
+            # the same block is written again, write_object turns it into a reference
+            s = self.shared_blocks[tokens[1]]
+        self.stack[-1].entries.append(s)
+
+    def write_lines(self, lines):
+        self.stack[-1].entries.extend(lines)
+
+    def write_rows(self, line_format, rows):
+        self.stack[-1].entries.append((line_format, rows))
+
+    def open_class(self, name):
+        block = OSGBlock(name)
+        self.stack[-1].entries.append(block)
+        self.stack.append(block)
+
+    def close_class(self):
+        block = self.stack.pop()
+        if self.spool != None and block.class_name() == "Geode":
+            self.spool_block(block)
+
+    def spool_block(self, block):
+        # the ids it gets now are only referenced by blocks written after it
+        chunks, buffered, output = self.chunks, self.buffered, self.output
+        self.chunks, self.buffered, self.output = [], 0, self.spool
+        offset = self.spool.tell()
+        known_objects = len(self.object_ids)
+        self.write_object(block)
+        self.flush()
+        self.chunks, self.buffered, self.output = chunks, buffered, output
+        # nothing inside the block is referenced from outside of it, and the freed
+        # blocks leave their python ids to new ones, so only the block keeps its id
+        key = (id(block),)
+        object_id = self.object_ids[key]
+        while len(self.object_ids) > known_objects:
+            self.object_ids.popitem()
+        self.object_ids[key] = object_id
+        self.spooled[key] = (offset, self.spool.tell() - offset)
+        # the header stays for the references to the block
+        block.entries = []
+
+    def copy_spooled(self, offset, size):
+        self.spool.seek(offset)
+        while size > 0:
+            data = self.spool.read(min(size, self.buffer_size))
+            self.write(data)
+            size -= len(data)
+        self.spool.seek(0, os.SEEK_END)
+
+    def begin_fragment(self):
+        self.stack.append(OSGBlock(""))
+
+    def end_fragment(self):
+        # the fragment is kept as plain lists, [header, entries] for a block
+        entries = self.stack.pop().entries
+        self.stack[-1].entries.extend(entries)
+        return self.fragment_entries(entries)
+
+    def fragment_entries(self, entries):
+        fragment = []
+        for entry in entries:
+            if isinstance(entry, OSGBlock):
+                entry = [entry.header, self.fragment_entries(entry.entries)]
+            elif isinstance(entry, tuple):
+                line_format, rows = entry
+                if numpy is None or not isinstance(rows, numpy.ndarray):
+                    rows = [tuple(row) for row in rows]
+                entry = (line_format, rows)
+            fragment.append(entry)
+        return fragment
+
+    def write_fragment(self, fragment, remap=None):
+        self.stack[-1].entries.extend(self.fragment_blocks(fragment, remap))
+
+    def fragment_blocks(self, fragment, remap):
+        entries = []
+        for entry in fragment:
+            if isinstance(entry, list):
+                block = OSGBlock(remap(entry[0]) if remap != None else entry[0])
+                block.entries = self.fragment_blocks(entry[1], remap)
+                entry = block
+            elif isinstance(entry, str) and remap != None:
+                entry = remap(entry)
+            entries.append(entry)
+        return entries
+
+    def close(self):
+        nodes = self.root.blocks()
+        if len(nodes) == 1:
+            root = nodes[0]
+        else:
+            root = OSGBlock("Group")
+            root.entries = nodes
+
+        self.pack("IIIII", OSGB_HEADER_LOW, OSGB_HEADER_HIGH, OSGB_READ_SCENE, OSGB_VERSION, 0)
+        # no compressor
+        self.write_string("0")
+        self.write_object(root)
+        self.flush()
+        self.output.close()
+        if self.spool != None:
+            self.spool.close()
+
+    # binary primitives
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.output.write(b"".join(self.chunks))
+        self.chunks = []
+        self.buffered = 0
+
+    def pack(self, fmt, *values):
+        self.write(struct.pack("<" + fmt, *values))
+
+    def pack_array(self, fmt, values):
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            self.write(values.astype(OSGB_NUMPY_TYPES[fmt]).tobytes())
+        else:
+            self.write(struct.pack("<%d%s" % (len(values), fmt), *values))
+
+    def write_bool(self, value):
+        self.pack("?", value)
+
+    def write_int(self, value):
+        self.pack("i", value)
+
+    def write_uint(self, value):
+        self.pack("I", value)
 
-def write_lamp(l):
+    def write_string(self, s):
+        data = s.encode("utf-8")
+        self.pack("I", len(data))
+        self.write(data)
+
+    def write_matrix(self, block):
+        if block is None:
+            self.pack("16d", *IDENTITY_MATRIX)
+        else:
+            self.pack_array("d", block.values())
+
+    # objects
+
+    def write_object(self, block, *args):
+        key = (id(block),) + tuple(id(arg) for arg in args)
+        if key in self.spooled:
+            # serialized when it was closed, the first time it is written it is copied
+            self.copy_spooled(*self.spooled.pop(key))
+            return
+        class_name = block.class_name()
+        writer_name, full_name = OSGB_WRITERS[class_name]
+        self.write_string(full_name)
+        if key in self.object_ids:
+            self.write_uint(self.object_ids[key])
+            return
+        self.object_count += 1
+        self.object_ids[key] = self.object_count
+        self.write_uint(self.object_count)
+        getattr(self, writer_name)(block, *args)
+
+    def write_optional_object(self, block, *args):
+        self.write_bool(block is not None)
+        if block is not None:
+            self.write_object(block, *args)
+
+    def write_object_list(self, blocks):
+        self.write_bool(len(blocks) > 0)
+        if blocks:
+            self.write_uint(len(blocks))
+            for block in blocks:
+                self.write_object(block)
+
+    def write_object_fields(self, name):
+        self.write_string(name)
+        # DataVariance UNSPECIFIED and no UserDataContainer
+        self.write_int(2)
+        self.write_bool(False)
+
+    def write_callbacks(self, callbacks):
+        # further callbacks are chained through NestedCallback
+        if not callbacks:
+            self.write_bool(False)
+            return
+        self.write_bool(True)
+        self.write_object(callbacks[0], callbacks[1:])
+
+    def write_node_fields(self, block):
+        self.write_object_fields(block.name())
+        # InitialBound, ComputeBoundingSphereCallback
+        self.write_bool(False)
+        self.write_bool(False)
+        update_callbacks = block.block("UpdateCallbacks")
+        self.write_callbacks(update_callbacks.blocks() if update_callbacks else [])
+        # EventCallback, CullCallback, CullingActive, NodeMask, Descriptions, StateSet
+        self.write_bool(False)
+        self.write_bool(False)
+        self.write_bool(True)
+        self.write_uint(0xffffffff)
+        self.write_bool(False)
+        self.write_bool(False)
+
+    def write_group(self, block):
+        self.write_node_fields(block)
+        self.write_object_list(block.blocks(OSGB_NODE_CLASSES))
+
+    def write_matrix_transform(self, block):
+        self.write_group(block)
+        # ReferenceFrame RELATIVE_RF
+        self.write_int(0)
+        self.write_matrix(block.block("Matrix"))
+
+    def write_bone(self, block):
+        self.write_matrix_transform(block)
+        self.write_matrix(block.block("InvBindMatrixInSkeletonSpace"))
+        self.write_matrix(None)
+
+    def write_geode(self, block):
+        self.write_node_fields(block)
+        drawables = []
+        for drawable in block.blocks(("Geometry", "osgAnimation::RigGeometry")):
+            if drawable.class_name() == "Geometry":
+                drawables.append((drawable,))
+            else:
+                # the text format nests every source geometry in one rig block
+                drawables.extend([(drawable, geometry) for geometry in drawable.blocks(("Geometry",))])
+        self.write_bool(len(drawables) > 0)
+        if drawables:
+            self.write_uint(len(drawables))
+            for drawable in drawables:
+                self.write_object(*drawable)
+
+    def write_drawable_fields(self, name, stateset):
+        self.write_object_fields(name)
+        self.write_optional_object(stateset)
+        # InitialBound, ComputeBoundingBoxCallback, Shape
+        self.write_bool(False)
+        self.write_bool(False)
+        self.write_bool(False)
+        # SupportsDisplayList, UseDisplayList, UseVertexBufferObjects
+        self.write_bool(True)
+        self.write_bool(True)
+        self.write_bool(False)
+        # Update, Event, Cull and Draw callbacks
+        for i in range(4):
+            self.write_bool(False)
+
+    def write_array(self, tokens):
+        if "Use" in tokens:
+            self.write_uint(self.array_ids[tokens[tokens.index("Use") + 1]])
+            return None
+        index = tokens.index("UniqueID")
+        array_id = len(self.array_ids) + 1
+        self.array_ids[tokens[index + 1]] = array_id
+        self.write_uint(array_id)
+        type_id, components = OSGB_ARRAY_TYPES[tokens[index + 2]]
+        self.write_int(type_id)
+        self.write_int(int(tokens[index + 3]))
+        return components
+
+    def write_array_data(self, entry, tokens):
+        # Array, Indices, Binding BIND_PER_VERTEX, Normalize
+        self.write_bool(True)
+        if self.write_array(tokens) is not None:
+            self.pack_array("f", entry.values())
+        self.write_bool(False)
+        self.write_int(4)
+        self.write_int(0)
+
+    def write_geometry_fields(self, block):
+        primitive_sets = block.block("PrimitiveSets")
+        primitives = primitive_sets.blocks() if primitive_sets else []
+        self.write_bool(len(primitives) > 0)
+        if primitives:
+            self.write_uint(len(primitives))
+            for primitive in primitives:
+                tokens = primitive.header.split()
+                type_id, index_format = OSGB_PRIMITIVE_TYPES[tokens[0]]
+                self.write_int(type_id)
+                self.write_int(OSGB_GL_ENUMS[tokens[1]])
+                self.write_uint(int(tokens[2]))
+                self.pack_array(index_format, primitive.values())
+
+        for keyword in ("VertexArray", "NormalArray"):
+            entry, tokens = block.find(keyword)
+            self.write_bool(entry is not None)
+            if entry is not None:
+                self.write_array_data(entry, tokens)
+
+        # ColorData, SecondaryColorData, FogCoordData
+        self.write_bool(False)
+        self.write_bool(False)
+        self.write_bool(False)
+
+        entry, tokens = block.find("TexCoordArray")
+        self.write_bool(entry is not None)
+        if entry is not None:
+            self.write_uint(1)
+            self.write_array_data(entry, tokens)
+
+        # VertexAttribData, FastPathHint
+        self.write_bool(False)
+        self.write_bool(False)
+
+    def write_geometry(self, block):
+        self.write_drawable_fields("", block.block("StateSet"))
+        self.write_geometry_fields(block)
+
+    def write_rig_geometry(self, block, geometry):
+        self.write_drawable_fields(block.name(), geometry.block("StateSet"))
+        # the rig keeps no arrays of its own, they are copied from the source geometry
+        self.write_geometry_fields(OSGBlock("Geometry"))
+        influences = block.blocks(("osgAnimation::VertexInfluence",))
+        self.write_bool(len(influences) > 0)
+        if influences:
+            self.write_uint(len(influences))
+            for influence in influences:
+                match = re.match(r'\S+ "(.*)" (\d+)$', influence.header)
+                self.write_string(match.group(1))
+                self.write_uint(int(match.group(2)))
+                values = influence.values()
+                self.pack("if" * (len(values) // 2), *values)
+        self.write_optional_object(geometry)
+
+    def write_state_attribute_fields(self, name):
+        self.write_object_fields(name)
+        # UpdateCallback, EventCallback
+        self.write_bool(False)
+        self.write_bool(False)
+
+    def write_modes(self, block):
+        modes = [line.split() for line in block.entries if isinstance(line, str) and line.startswith("GL_")]
+        self.write_uint(len(modes))
+        for mode, value in modes:
+            self.write_uint(OSGB_GL_ENUMS[mode])
+            self.write_int(1 if value == "ON" else 0)
+
+    def write_stateset(self, block):
+        self.write_object_fields("")
+
+        has_modes = any(isinstance(line, str) and line.startswith("GL_") for line in block.entries)
+        self.write_bool(has_modes)
+        if has_modes:
+            self.write_modes(block)
+
+        attributes = block.blocks(("Material",))
+        self.write_bool(len(attributes) > 0)
+        if attributes:
+            self.write_uint(len(attributes))
+            for attribute in attributes:
+                self.write_object(attribute)
+                self.write_int(0)
+
+        units = block.blocks(("textureUnit",))
+        self.write_bool(len(units) > 0)
+        if units:
+            self.write_uint(len(units))
+            for unit in units:
+                self.write_modes(unit)
+        self.write_bool(len(units) > 0)
+        if units:
+            self.write_uint(len(units))
+            for unit in units:
+                textures = unit.blocks(("Texture2D",))
+                self.write_uint(len(textures))
+                for texture in textures:
+                    self.write_object(texture)
+                    self.write_int(0)
+
+        # UniformList
+        self.write_bool(False)
+        hint, bin_mode, bin_number, bin_name = OSGB_RENDERING_HINTS[block.field("rendering_hint", "DEFAULT_BIN")]
+        self.write_int(hint)
+        self.write_int(bin_mode)
+        self.write_int(bin_number)
+        self.write_string(bin_name)
+        # NestRenderBins, UpdateCallback, EventCallback
+        self.write_bool(True)
+        self.write_bool(False)
+        self.write_bool(False)
+
+    def write_material(self, block):
+        self.write_state_attribute_fields(block.name())
+        # ColorMode OFF
+        self.write_int(0x1603)
+        for keyword in ("ambientColor", "diffuseColor", "specularColor", "emissionColor"):
+            color = block.floats(keyword, [0.0, 0.0, 0.0, 1.0])
+            # front and back share the value
+            self.write_bool(True)
+            self.write_bool(True)
+            self.pack("8f", *(color + color))
+        shininess = block.floats("shininess", [0.0])[0]
+        self.write_bool(True)
+        self.write_bool(True)
+        self.pack("2f", shininess, shininess)
+
+    def write_texture2d(self, block):
+        self.write_state_attribute_fields(block.name())
+        for keyword in ("wrap_s", "wrap_t", "wrap_r", "min_filter", "mag_filter"):
+            self.write_bool(True)
+            self.write_uint(OSGB_GL_ENUMS[block.field(keyword, "REPEAT" if keyword.startswith("wrap") else "LINEAR")])
+        # MaxAnisotropy, UseHardwareMipMapGeneration, UnRefImageDataAfterApply, ClientStorageHint
+        self.pack("f???", 1.0, True, False, False)
+        self.write_bool(block.field("resizeNonPowerOfTwo", "TRUE") == "TRUE")
+        # BorderColor, BorderWidth, InternalFormatMode USE_IMAGE_DATA_FORMAT
+        self.pack("4d", 0.0, 0.0, 0.0, 0.0)
+        self.write_int(0)
+        self.write_int(0)
+        # InternalFormat, SourceFormat, SourceType, ShadowComparison
+        self.pack("????", False, False, False, False)
+        # ShadowCompareFunc LEQUAL, ShadowTextureMode LUMINANCE, ShadowAmbient
+        self.pack("iif", 0x0203, 0x1909, 0.0)
+
+        filename = block.field("file")
+        self.write_bool(filename is not None)
+        if filename is not None:
+            # the image is referenced as an external file
+            self.object_count += 1
+            self.object_ids[(id(block), "image")] = self.object_count
+            self.write_uint(self.object_count)
+            self.write_string(filename[1:-1])
+            self.write_int(0)
+            self.write_int(2)
+            self.write_object_fields("")
+        # TextureWidth, TextureHeight
+        self.write_int(0)
+        self.write_int(0)
+
+    def write_light_source(self, block):
+        self.write_group(block)
+        self.write_optional_object(block.block("Light"))
+        # ReferenceFrame RELATIVE_RF
+        self.write_int(0)
+
+    def write_light(self, block):
+        self.write_state_attribute_fields("")
+        # LightNum
+        self.write_int(0)
+        self.pack("4f", *block.floats("ambient", [0.0, 0.0, 0.0, 1.0]))
+        self.pack("4f", *block.floats("diffuse", [0.0, 0.0, 0.0, 1.0]))
+        self.pack("4f", *block.floats("specular", [0.0, 0.0, 0.0, 1.0]))
+        self.pack("4f", *(block.floats("position", [0.0, 0.0, 1.0]) + [1.0])[:4])
+        self.pack("3f", *block.floats("direction", [0.0, 0.0, -1.0]))
+        for keyword, default in (("constant_attenuation", 1.0), ("linear_attenuation", 0.0), ("quadratic_attenuation", 0.0), ("spot_exponent", 0.0), ("spot_cutoff", 180.0)):
+            self.pack("f", block.floats(keyword, [default])[0])
+
+    def write_callback_fields(self, block, nested):
+        self.write_object_fields(block.name())
+        self.write_callbacks(nested)
+
+    def write_update_bone(self, block, nested):
+        self.write_callback_fields(block, nested)
+        self.write_object_list(block.blocks())
+
+    def write_animation_manager(self, block, nested):
+        self.write_callback_fields(block, nested)
+        self.write_object_list(block.blocks(("osgAnimation::Animation",)))
+        # AutomaticLink
+        self.write_bool(True)
+
+    def write_animation(self, block):
+        self.write_object_fields(block.name())
+        channels = block.blocks(OSGB_CHANNEL_KEYS)
+        keyframes = [channel.block("Keyframes").values() for channel in channels]
+        times = []
+        for channel, keys in zip(channels, keyframes):
+            times.extend(keys[::OSGB_CHANNEL_KEYS[channel.class_name()][1]])
+        # Duration, Weight, StartTime, PlayMode LOOP
+        self.pack("dfdi", max(times) - min(times) if times else 0.0, 0.0, 0.0, 2)
+        self.write_bool(len(channels) > 0)
+        if channels:
+            self.write_uint(len(channels))
+            for channel, keys in zip(channels, keyframes):
+                key_format, size = OSGB_CHANNEL_KEYS[channel.class_name()]
+                self.write_string(channel.class_name())
+                self.write_string(channel.name())
+                self.write_string(channel.field("target")[1:-1])
+                self.write_bool(True)
+                self.write_uint(len(keys) // size)
+                self.pack(key_format * (len(keys) // size), *keys)
+
+    def write_stacked_matrix(self, block):
+        self.write_object_fields(block.name())
+        self.write_matrix(block.block("Matrix"))
+
+    def write_stacked_translate(self, block):
+        self.write_object_fields(block.name())
+        self.pack("3f", 0.0, 0.0, 0.0)
+
+    def write_stacked_quaternion(self, block):
+        self.write_object_fields(block.name())
+        self.pack("4d", 0.0, 0.0, 0.0, 1.0)
+
+    def write_stacked_scale(self, block):
+        self.write_object_fields(block.name())
+        self.pack("3f", 1.0, 1.0, 1.0)
+
+# text format class name -> (writer method, serializer class name)
+OSGB_WRITERS = {
+    "Group": ("write_group", "osg::Group"),
+    "MatrixTransform": ("write_matrix_transform", "osg::MatrixTransform"),
+    "Geode": ("write_geode", "osg::Geode"),
+    "LightSource": ("write_light_source", "osg::LightSource"),
+    "Light": ("write_light", "osg::Light"),
+    "Geometry": ("write_geometry", "osg::Geometry"),
+    "StateSet": ("write_stateset", "osg::StateSet"),
+    "Material": ("write_material", "osg::Material"),
+    "Texture2D": ("write_texture2d", "osg::Texture2D"),
+    "osgAnimation::Skeleton": ("write_matrix_transform", "osgAnimation::Skeleton"),
+    "osgAnimation::Bone": ("write_bone", "osgAnimation::Bone"),
+    "osgAnimation::RigGeometry": ("write_rig_geometry", "osgAnimation::RigGeometry"),
+    "osgAnimation::UpdateSkeleton": ("write_callback_fields", "osgAnimation::UpdateSkeleton"),
+    "osgAnimation::UpdateBone": ("write_update_bone", "osgAnimation::UpdateBone"),
+    "osgAnimation::BasicAnimationManager": ("write_animation_manager", "osgAnimation::BasicAnimationManager"),
+    "osgAnimation::Animation": ("write_animation", "osgAnimation::Animation"),
+    "osgAnimation::StackedMatrixElement": ("write_stacked_matrix", "osgAnimation::StackedMatrixElement"),
+    "osgAnimation::StackedTranslateElement": ("write_stacked_translate", "osgAnimation::StackedTranslateElement"),
+    "osgAnimation::StackedQuaternionElement": ("write_stacked_quaternion", "osgAnimation::StackedQuaternionElement"),
+    "osgAnimation::StackedScaleElement": ("write_stacked_scale", "osgAnimation::StackedScaleElement"),
+    }
+
+OSGB_NODE_CLASSES = ("Group", "MatrixTransform", "Geode", "LightSource", "osgAnimation::Skeleton", "osgAnimation::Bone")
+
+class LampData(object):
+    '''A lamp as its LightSource is written, with the ambient color of the scene world'''
+    __slots__ = ("name", "type", "ambient", "diffuse", "specular", "position", "direction",
+                 "constant_attenuation", "linear_attenuation", "quadratic_attenuation", "spot_exponent", "spot_cutoff")
+
+def extract_lamp(l):
+    # the light of lamp object l, None for the lamp types openscenegraph has no light for
     global current_scene
-    
+
     lamp = l.data
     if lamp.type == "AREA":
         print("Warning: Area lamp type is not supported in openscenegraph. Skipping.\n")
-        return
+        return None
     if lamp.type == 'SUN':
         print("Warning: Sun lamp type is not supported in openscenegraph. Skipping.\n")
-        return
-
+        return None
+
+    light = LampData()
+    light.name = l.name
+    light.type = lamp.type
+    ambient_color = current_scene.world.ambient_color
+    light.ambient = (ambient_color[0], ambient_color[1], ambient_color[2])
+    light.diffuse = None
+    if lamp.use_diffuse:
+        light.diffuse = (lamp.color[0], lamp.color[1], lamp.color[2])
+    light.specular = lamp.use_specular
+    light.position = (l.location[0], l.location[1], l.location[2])
+    light.direction = None
+    if lamp.type in ('SPOT', 'HEMI'):
+        v = mathutils.Vector((0, 0, -1))
+        v.normalize()
+        v.rotate(l.rotation_euler)
+        light.direction = (v[0], v[1], v[2])
+    light.constant_attenuation = lamp.distance
+    light.linear_attenuation = None
+    light.quadratic_attenuation = None
+    light.spot_exponent = None
+    light.spot_cutoff = None
+    if lamp.type == 'POINT':
+        light.linear_attenuation = lamp.linear_attenuation
+        light.quadratic_attenuation = lamp.quadratic_attenuation
+    if lamp.type == 'SPOT':
+        light.linear_attenuation = lamp.distance
+        light.quadratic_attenuation = lamp.quadratic_attenuation
+        light.spot_exponent = lamp.spot_blend
+        light.spot_cutoff = math.degrees(lamp.spot_size)
+    return light
 
+def write_lamp(light):
     open_class("LightSource")
-    write_indented("name \"%s\"" % l.name)
+    write_indented("name \"%s\"" % light.name)
     open_class("Light")
-    write_indented("ambient %f %f %f %f" % (current_scene.world.ambient_color[0], current_scene.world.ambient_color[1], current_scene.world.ambient_color[2], 1))
+    write_indented("ambient %f %f %f %f" % (light.ambient[0], light.ambient[1], light.ambient[2], 1))
 
-    if lamp.use_diffuse:
-        write_indented("diffuse %f %f %f %f" % (lamp.color[0], lamp.color[1], lamp.color[2], 1))
+    if light.diffuse != None:
+        write_indented("diffuse %f %f %f %f" % (light.diffuse[0], light.diffuse[1], light.diffuse[2], 1))
     else:
         write_indented("diffuse 0 0 0 0")
 
-    if lamp.use_specular:
+    if light.specular:
         write_indented("specular 1.00000 1.00000 1.00000 1.00000")
     else:
         write_indented("specular 0 0 0 0")
 
-    if lamp.type == 'POINT':
-        write_indented("position %f %f %f" % (l.location[0], l.location[1], l.location[2]))
-        write_indented("constant_attenuation %f" % lamp.distance)
-        write_indented("linear_attenuation %f" % lamp.linear_attenuation)
-        write_indented("quadratic_attenuation %f" % lamp.quadratic_attenuation)
-    if lamp.type == 'SPOT':
-        write_indented("position %f %f %f" % (l.location[0], l.location[1], l.location[2]))
-        v = mathutils.Vector((0, 0, -1))
-        v.normalize()
-        v.rotate(l.rotation_euler)
-        write_indented("direction %f %f %f" % (v[0], v[1], v[2]))
-        write_indented("constant_attenuation %f" % lamp.distance)
-        write_indented("linear_attenuation %f" % lamp.distance)
-        write_indented("quadratic_attenuation %f" % lamp.quadratic_attenuation)
-        write_indented("spot_exponent %f" % lamp.spot_blend)
-        write_indented("spot_cutoff %f" % math.degrees(lamp.spot_size))
-    elif lamp.type == "HEMI":
-        write_indented("position %f %f %f" % (l.location[0], l.location[1], l.location[2]))
-        write_indented("constant_attenuation %f" % lamp.distance)
-        v = mathutils.Vector((0, 0, -1))
-        v.normalize()
-        v.rotate(l.rotation_euler)
-        write_indented("direction %f %f %f" % (v[0], v[1], v[2]))
+    if light.type == 'POINT':
+        write_indented("position %f %f %f" % light.position)
+        write_indented("constant_attenuation %f" % light.constant_attenuation)
+        write_indented("linear_attenuation %f" % light.linear_attenuation)
+        write_indented("quadratic_attenuation %f" % light.quadratic_attenuation)
+    if light.type == 'SPOT':
+        write_indented("position %f %f %f" % light.position)
+        write_indented("direction %f %f %f" % light.direction)
+        write_indented("constant_attenuation %f" % light.constant_attenuation)
+        write_indented("linear_attenuation %f" % light.linear_attenuation)
+        write_indented("quadratic_attenuation %f" % light.quadratic_attenuation)
+        write_indented("spot_exponent %f" % light.spot_exponent)
+        write_indented("spot_cutoff %f" % light.spot_cutoff)
+    elif light.type == "HEMI":
+        write_indented("position %f %f %f" % light.position)
+        write_indented("constant_attenuation %f" % light.constant_attenuation)
+        write_indented("direction %f %f %f" % light.direction)
 
 
     close_class()
     write_indented("num_children 0")
     close_class()
 
+def quantize(values, epsilon):
+    if epsilon <= 0:
+        return tuple(values)
+    return tuple(int(round(v / epsilon)) for v in values)
+
+def new_array(size, integer=False):
+    # a buffer for foreach_get, a NumPy array when NumPy is available
+    if numpy != None:
+        if integer:
+            return numpy.zeros(size, dtype=numpy.int32)
+        return numpy.zeros(size, dtype=numpy.float32)
+    if integer:
+        return [0] * size
+    return [0.0] * size
+
+def take(values, order):
+    # values[i] for every i in order, vectorized for NumPy arrays
+    if numpy != None and isinstance(values, numpy.ndarray):
+        return values[numpy.asarray(order, dtype=numpy.int64)]
+    return [values[index] for index in order]
+
+def as_list(values):
+    # plain python values of an array, for the loops that work through it one by one
+    if numpy != None and isinstance(values, numpy.ndarray):
+        return values.tolist()
+    return values
+
+def largest_index(faces):
+    if numpy != None and isinstance(faces, numpy.ndarray):
+        return int(faces.max())
+    return max([max(indices) for indices in faces])
+
+def extract_mesh_arrays(mesh):
+    # Pull the vertex and face attributes of mesh out in bulk with foreach_get.
+    # Returns flat (coordinates, normals, face_vertices, face_sizes, material_indices, face_uvs):
+    # 3 values per vertex, 4 vertex indices and 8 uv values per face (unused slots of
+    # triangles are 0). face_uvs is None when the mesh has no uv layer.
+    num_vertices = len(mesh.vertices)
+    num_faces = len(mesh.faces)
+
+    coordinates = new_array(num_vertices * 3)
+    normals = new_array(num_vertices * 3)
+    mesh.vertices.foreach_get("co", coordinates)
+    mesh.vertices.foreach_get("normal", normals)
+
+    face_vertices = new_array(num_faces * 4, True)
+    material_indices = new_array(num_faces, True)
+    mesh.faces.foreach_get("vertices_raw", face_vertices)
+    mesh.faces.foreach_get("material_index", material_indices)
+
+    # blender never stores vertex 0 in the fourth slot of a quad
+    if numpy != None:
+        face_sizes = 3 + (face_vertices[3::4] != 0)
+    else:
+        face_sizes = [3 + (face_vertices[face_index * 4 + 3] != 0) for face_index in range(num_faces)]
+
+    face_uvs = None
+    texture_face_layer = mesh.uv_textures.active
+    if texture_face_layer != None:
+        face_uvs = new_array(num_faces * 8)
+        texture_face_layer.data.foreach_get("uv_raw", face_uvs)
+
+    return coordinates, normals, face_vertices, face_sizes, material_indices, face_uvs
+
+def bucket_faces(face_sizes, material_indices):
+    # group the face indices by (material_index, number of vertices) in a single pass
+    buckets = {}
+    for face_index in range(len(face_sizes)):
+        key = (material_indices[face_index], face_sizes[face_index])
+        if key in buckets:
+            buckets[key].append(face_index)
+        else:
+            buckets[key] = [face_index]
+    return buckets
+
+def build_vertex_arrays(mesh_arrays, weld, epsilon, keep_sources):
+    # Turn the face corners from extract_mesh_arrays into indexed vertex arrays.
+    # When weld is set, corners that share position, normal and uv (within epsilon)
+    # become one shared vertex, otherwise every corner gets its own vertex (hard seams).
+    # With keep_sources only corners of the same mesh vertex are welded, so that
+    # coincident vertices keep their own vertex group weights.
+    # Returns (positions, normals, uvs, vertex_sources, bucket_indices) where vertex_sources
+    # maps each exported vertex back to its mesh vertex and bucket_indices holds, for every
+    # (material_index, number of vertices) bucket of faces, the exported vertex indices
+    # of each face's corners.
+    if numpy != None:
+        return build_vertex_arrays_numpy(mesh_arrays, weld, epsilon, keep_sources)
+
+    coordinates, vertex_normals, face_vertices, face_sizes, material_indices, face_uvs = mesh_arrays
+    buckets = bucket_faces(face_sizes, material_indices)
+
+    positions = []
+    normals = []
+    uvs = []
+    vertex_sources = []
+    bucket_indices = {}
+    welded = {}
+
+    # first do triangles, then quads
+    for key in sorted(buckets, key=lambda key: (key[1], key[0])):
+        faces = []
+        for face_index in buckets[key]:
+            indices = []
+            for corner in range(key[1]):
+                source = face_vertices[face_index * 4 + corner]
+                co = tuple(coordinates[source * 3:source * 3 + 3])
+                normal = tuple(vertex_normals[source * 3:source * 3 + 3])
+                uv = None
+                if face_uvs != None:
+                    uv = tuple(face_uvs[face_index * 8 + corner * 2:face_index * 8 + corner * 2 + 2])
+
+                if weld:
+                    weld_key = quantize(co, epsilon) + quantize(normal, epsilon)
+                    if uv != None:
+                        weld_key += quantize(uv, epsilon)
+                    if keep_sources:
+                        weld_key += (source,)
+                    if weld_key in welded:
+                        indices.append(welded[weld_key])
+                        continue
+                    welded[weld_key] = len(positions)
+
+                indices.append(len(positions))
+                positions.append(co)
+                normals.append(normal)
+                if uv != None:
+                    uvs.append(uv)
+                vertex_sources.append(source)
+            faces.append(indices)
+        bucket_indices[key] = faces
+
+    return positions, normals, uvs, vertex_sources, bucket_indices
+
+def build_vertex_arrays_numpy(mesh_arrays, weld, epsilon, keep_sources):
+    # vectorized build_vertex_arrays
+    coordinates, vertex_normals, face_vertices, face_sizes, material_indices, face_uvs = mesh_arrays
+
+    # sort the faces into buckets, triangles first, keeping the face order within a bucket
+    face_order = numpy.lexsort((material_indices, face_sizes))
+    sizes = face_sizes[face_order]
+
+    # one entry per face corner
+    corner_faces = numpy.repeat(face_order, sizes)
+    corner_slots = numpy.arange(len(corner_faces)) - numpy.repeat(numpy.cumsum(sizes) - sizes, sizes)
+    corner_sources = face_vertices.reshape(-1, 4)[corner_faces, corner_slots]
+
+    corner_data = [coordinates.reshape(-1, 3)[corner_sources], vertex_normals.reshape(-1, 3)[corner_sources]]
+    if face_uvs is not None:
+        corner_data.append(face_uvs.reshape(-1, 4, 2)[corner_faces, corner_slots])
+    corner_data = numpy.hstack(corner_data)
+
+    if weld and len(corner_data) > 0:
+        if epsilon > 0:
+            weld_keys = numpy.round(corner_data / epsilon).astype(numpy.int64)
+        else:
+            weld_keys = corner_data
+        if keep_sources:
+            weld_keys = numpy.column_stack((weld_keys, corner_sources))
+        unique_keys, first_corners, corner_vertices = numpy.unique(weld_keys, axis=0, return_index=True, return_inverse=True)
+        # number the vertices in the order their first corner appears
+        appearance = numpy.argsort(first_corners)
+        rank = numpy.empty(len(first_corners), dtype=numpy.int64)
+        rank[appearance] = numpy.arange(len(first_corners))
+        corner_vertices = rank[corner_vertices.reshape(-1)]
+        vertex_corners = first_corners[appearance]
+    else:
+        corner_vertices = numpy.arange(len(corner_data))
+        vertex_corners = corner_vertices
+
+    vertex_data = corner_data[vertex_corners].astype(numpy.float64)
+    positions = vertex_data[:, 0:3]
+    normals = vertex_data[:, 3:6]
+    uvs = vertex_data[:, 6:8]
+    vertex_sources = corner_sources[vertex_corners]
+
+    bucket_indices = {}
+    face_keys = numpy.stack((sizes, material_indices[face_order]), axis=1)
+    bucket_starts = numpy.flatnonzero(numpy.any(face_keys[1:] != face_keys[:-1], axis=1)) + 1
+    face_starts = numpy.concatenate(([0], bucket_starts))
+    face_ends = numpy.concatenate((bucket_starts, [len(face_order)]))
+    corner_offsets = numpy.concatenate(([0], numpy.cumsum(sizes)))
+    for face_start, face_end in zip(face_starts, face_ends):
+        if face_start == face_end:
+            continue
+        size = int(sizes[face_start])
+        key = (int(face_keys[face_start][1]), size)
+        corners = corner_vertices[corner_offsets[face_start]:corner_offsets[face_end]]
+        bucket_indices[key] = corners.reshape(-1, size)
+
+    return positions, normals, uvs, vertex_sources, bucket_indices
+
+def create_unique_id(prefix):
+    global unique_id_count
+    unique_id_count += 1
+    return "%s_%d" % (prefix, unique_id_count)
+
+def fork_process_pool(workers):
+    # A pool of processes forked from blender, they find the exporter without importing bpy.
+    # None where python can not fork one: the start methods came with python 3.4 and the
+    # mp_context of ProcessPoolExecutor with python 3.7.
+    if not hasattr(multiprocessing, "get_context") or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    try:
+        pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+    except TypeError:
+        return None
+    # fork all the workers now
+    pool.submit(int).result()
+    return pool
+
+def start_texture_pool():
+    # started with the first texture to encode, scenes without textures need no pool
+    global texture_pool
+    if numpy is None:
+        # without NumPy the pixels are converted by python loops that hold the GIL,
+        # NumPy and zlib release it so threads encode in parallel then
+        texture_pool = fork_process_pool(texture_pool_size)
+    if texture_pool is None:
+        texture_pool = concurrent.futures.ThreadPoolExecutor(texture_pool_size)
+
+def start_texture_export():
+    # Images written by this export, the pool that encodes them, and the content
+    # hashes of the images written by earlier exports of the same file
+    global exported_images, texture_jobs, texture_pool, texture_pool_size, texture_cache, texture_cache_path
+    exported_images = {}
+    texture_jobs = []
+    texture_pool = None
+    texture_pool_size = texture_workers or multiprocessing.cpu_count()
+    texture_cache_path = os.path.join(os.path.dirname(filepath), "." + os.path.basename(filepath) + TEXTURE_CACHE_SUFFIX)
+    try:
+        with open(texture_cache_path) as cache_file:
+            texture_cache = json.load(cache_file)
+    except (IOError, ValueError):
+        texture_cache = {}
+
+def finish_texture_export():
+    # waits for every texture still being encoded, then records the written files
+    start = time.time()
+    for key, content_hash, filename, job in texture_jobs:
+        try:
+            job.result()
+            texture_cache[key] = {"hash": content_hash, "size": os.path.getsize(filename)}
+            add_count("texture_bytes", texture_cache[key]["size"])
+        except Exception as e:
+            texture_cache.pop(key, None)
+            print("Warning: could not write the texture %s: %s" % (filename, e))
+    if texture_pool != None:
+        texture_pool.shutdown()
+    add_time("textures", start)
+
+    # written next to it and renamed, so an export that stops half way leaves the old cache
+    try:
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(texture_cache_path), delete=False) as cache_file:
+            json.dump(texture_cache, cache_file, indent=1, sort_keys=True)
+        if hasattr(os, "replace"):
+            os.replace(cache_file.name, texture_cache_path)
+        else:
+            # python 3.2 has no os.replace, and os.rename does not overwrite a file on windows
+            if os.name == 'nt' and os.path.exists(texture_cache_path):
+                os.remove(texture_cache_path)
+            os.rename(cache_file.name, texture_cache_path)
+    except (IOError, OSError):
+        print("Warning: could not write the texture cache %s" % texture_cache_path)
+
+def image_content_hash(width, height, pixels):
+    digest = hashlib.sha1()
+    # the size the png is written at is part of its content
+    digest.update(("%d %d %d %d" % (width, height, texture_max_size, texture_power_of_two)).encode("utf-8"))
+    digest.update(pixels.tobytes())
+    return digest.hexdigest()
+
+def read_pixels(image):
+    # the float rgba pixels of image as an array('f'), copied in slices since
+    # a tuple of the whole image takes eight times the memory
+    pixels = array.array('f')
+    count = len(image.pixels)
+    for start in range(0, count, PIXEL_SLICE):
+        pixels.extend(image.pixels[start:min(start + PIXEL_SLICE, count)])
+    return pixels
+
+def get_texture_size(width, height, max_size, power_of_two):
+    # size of the written png: scaled down to max_size, then to the nearest power of two
+    if max_size > 0 and max(width, height) > max_size:
+        scale = float(max_size) / max(width, height)
+        width = max(1, int(round(width * scale)))
+        height = max(1, int(round(height * scale)))
+    if power_of_two:
+        sizes = []
+        for size in (width, height):
+            power = 1
+            while power * 2 <= size:
+                power *= 2
+            if size - power > power * 2 - size and (max_size <= 0 or power * 2 <= max_size):
+                power *= 2
+            sizes.append(power)
+        width, height = sizes
+    return width, height
+
+def pixels_to_bytes(pixels):
+    # blender float rgba -> 8 bit rgba
+    if numpy is not None:
+        return (numpy.clip(numpy.asarray(pixels, dtype=numpy.float32), 0.0, 1.0) * 255.0 + 0.5).astype(numpy.uint8).tobytes()
+    return bytes(bytearray([int(min(max(value, 0.0), 1.0) * 255.0 + 0.5) for value in pixels]))
+
+def resize_pixels(data, width, height, new_width, new_height):
+    # nearest neighbour scaling of 8 bit rgba rows
+    if numpy is not None:
+        image = numpy.frombuffer(data, dtype=numpy.uint8).reshape(height, width, 4)
+        rows = numpy.arange(new_height) * height // new_height
+        columns = numpy.arange(new_width) * width // new_width
+        return numpy.ascontiguousarray(image[rows][:, columns]).tobytes()
+    columns = [(x * width // new_width) * 4 for x in range(new_width)]
+    resized = []
+    for y in range(new_height):
+        start = (y * height // new_height) * width * 4
+        row = data[start:start + width * 4]
+        resized.extend([row[column:column + 4] for column in columns])
+    return b"".join(resized)
+
+def png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+def write_png(filename, width, height, data):
+    # 8 bit rgba png, blender stores the bottom row first
+    stride = width * 4
+    rows = [b"\x00" + data[y * stride:(y + 1) * stride] for y in range(height - 1, -1, -1)]
+    with open(filename, 'wb') as png_file:
+        png_file.write(b"\x89PNG\r\n\x1a\n")
+        png_file.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        png_file.write(png_chunk(b"IDAT", zlib.compress(b"".join(rows), 6)))
+        png_file.write(png_chunk(b"IEND", b""))
+
+def encode_texture(filename, width, height, pixels, max_size, power_of_two):
+    # runs in a thread or process of the texture pool, it must not touch bpy
+    data = pixels_to_bytes(pixels)
+    new_width, new_height = get_texture_size(width, height, max_size, power_of_two)
+    if (new_width, new_height) != (width, height):
+        data = resize_pixels(data, width, height, new_width, new_height)
+    write_png(filename, new_width, new_height, data)
+
+def export_image(image):
+    # Queues the image to be written as png next to the exported file, at most
+    # once per export. A png that already holds the same pixels is kept as it is.
+    # Returns the file name, None if the image could not be saved.
+    if image in exported_images:
+        return exported_images[image]
+
+    filename = os.path.join(os.path.dirname(filepath), os.path.basename(filepath).split(".")[0] + "-" + os.path.basename(image.filepath).split(".")[0] + ".png");
+    key = os.path.abspath(filename)
+    width, height = image.size[0], image.size[1]
+    pixels = read_pixels(image)
+    content_hash = image_content_hash(width, height, pixels)
+    cached = texture_cache.get(key)
+    if cached != None and cached["hash"] == content_hash and os.path.isfile(filename) and os.path.getsize(filename) == cached["size"]:
+        exported_images[image] = filename
+        return filename
+
+    if len(pixels) == width * height * 4 and len(pixels) > 0:
+        # encoding runs while the geometry is written, with at most two textures
+        # per worker waiting so their pixels do not pile up
+        pending = [job for key, content_hash, name, job in texture_jobs if not job.done()]
+        if len(pending) >= 2 * texture_pool_size:
+            concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        if texture_pool is None:
+            start_texture_pool()
+        job = texture_pool.submit(encode_texture, filename, width, height, pixels, texture_max_size, texture_power_of_two)
+        texture_jobs.append((key, content_hash, filename, job))
+    else:
+        # no pixel buffer to encode, let blender render the image
+        original_format = current_scene.render.file_format
+        current_scene.render.file_format = 'PNG'
+        try:
+            image.save_render(filename, current_scene)
+            texture_cache[key] = {"hash": content_hash, "size": os.path.getsize(filename)}
+        except:
+            texture_cache.pop(key, None)
+            filename = None
+        current_scene.render.file_format = original_format
+
+    exported_images[image] = filename
+    return filename
+
+class MaterialData(object):
+    '''The state of one material slot as it is written, with the object color applied'''
+    __slots__ = ("name", "transparent", "ambient", "diffuse", "emission", "shininess", "texture")
+
+class TextureData(object):
+    '''An image texture of a material and the png it was exported to'''
+    __slots__ = ("name", "filename", "wrap_s", "wrap_t")
+
+def extract_material(m, material_slot):
+    # read a material slot of m once per export, it is shared by every object using it
+    material = material_slot.material
+    key = (material_slot.name, material, tuple(m.color) if material.use_object_color else None)
+    if key in extracted_materials:
+        return extracted_materials[key]
+
+    data = MaterialData()
+    data.name = material_slot.name
+    data.transparent = material.alpha < 1.0
+    data.ambient = material.ambient
+
+    d = list(material.diffuse_color)
+    if material.use_object_color:
+        d[0] *= m.color[0]
+        d[1] *= m.color[1]
+        d[2] *= m.color[2]
+    data.diffuse = (d[0] * material.diffuse_intensity,
+                    d[1] * material.diffuse_intensity,
+                    d[2] * material.diffuse_intensity,
+                    material.alpha)
+    data.emission = material.emit
+    # Hardness is a value from 1 - 511
+    # The equation below brings it back to the range 0.0 to 10.0
+    data.shininess = (material.specular_hardness - 1.0) / 51.0
+
+    data.texture = None
+    if material.active_texture != None and material.active_texture.type == 'IMAGE' and material.active_texture.image != None:
+        image_texture = material.active_texture
+        start = time.time()
+        filename = export_image(image_texture.image)
+        add_time("textures", start, m.name)
+        if filename != None:
+            texture = TextureData()
+            texture.name = image_texture.image.name
+            texture.filename = filename
+            texture.wrap_s = "REPEAT" if image_texture.repeat_x > 1 else "CLAMP"
+            texture.wrap_t = "REPEAT" if image_texture.repeat_y > 1 else "CLAMP"
+            data.texture = texture
+
+    extracted_materials[key] = data
+    return data
+
+def write_material(material):
+    open_class("StateSet")
+
+    if material.transparent:
+        write_indented("GL_BLEND ON")
+        write_indented("rendering_hint TRANSPARENT_BIN")
+    else:
+        write_indented("rendering_hint OPAQUE_BIN")
+
+    open_class("Material")
+    write_indented("name \"%s\"" % material.name)
+
     
-def write_mesh(m, recursive, animation):
-    global current_scene, export_animations, orphan_meshes
+    write_indented("ColorMode OFF")
+    write_indented("ambientColor %f %f %f %f" % (material.ambient, material.ambient, material.ambient, material.ambient))
+    write_indented("diffuseColor %f %f %f %f" % material.diffuse)
+    write_indented("specularColor %f %f %f %f" % (0,
+                                                 0,
+                                                 0,
+                                                 1))
 
-    orphan_meshes.remove(m)
-    open_class("Geode")
-    write_indented("name \"%s\"" % m.name)
-    # count the drawables
-    # draw each material as a separate geometry - but they all share the same vertex and normal lists
+    write_indented("emissionColor %f %f %f %f" % (material.emission, material.emission, material.emission, material.emission))
+    write_indented("shininess %f" % material.shininess)
 
-    modified_mesh = m.to_mesh(current_scene, apply_modifiers, 'RENDER')
-    material_index = 0
-
-    # flatten the primitives
-    vertices = []
-    num_tris = 0
-    num_quads = 0
-    # first do triangles
-    for face in modified_mesh.faces:
-        if len(face.vertices) == 3:
-            vertices.append(modified_mesh.vertices[face.vertices[0]])
-            vertices.append(modified_mesh.vertices[face.vertices[1]])
-            vertices.append(modified_mesh.vertices[face.vertices[2]])
-            num_tris += 1
-
-    # then do quads
-    for face in modified_mesh.faces:
-        if len(face.vertices) == 4:
-            vertices.append(modified_mesh.vertices[face.vertices[0]])
-            vertices.append(modified_mesh.vertices[face.vertices[1]])
-            vertices.append(modified_mesh.vertices[face.vertices[2]])
-            vertices.append(modified_mesh.vertices[face.vertices[3]])
-            num_quads += 1
-
-    if animation and export_animations:
-        # TODO - wrap the geometry in a rig geometry
-        write_indented("num_drawables 1")
-        open_class("osgAnimation::RigGeometry")
-        write_indented("name \"%s\"" % (m.name))
-
-        # export the vertex groups
-        write_indented("num_influences %d" % (len(m.vertex_groups)))
-        for vertex_group in m.vertex_groups:
-            weights = {}
-            for index in range(0, len(vertices)):
-                for vertex_vertex_group in vertices[index].groups:
-                    if vertex_vertex_group.group == vertex_group.index:
-                        weights[index] = vertex_vertex_group.weight
-
-            open_class("osgAnimation::VertexInfluence \"%s\" %d" % (vertex_group.name, len(weights)))
-            for index, weight in weights.items():
-                write_indented("%d %f" % (index, weight))
-            close_class()
+    close_class()
+    
+    if material.texture != None:
+        texture = material.texture
+        open_class("textureUnit 0")
+        write_indented("GL_TEXTURE_2D ON")
+        open_class("Texture2D")
+        write_indented("name \"%s\"" % (texture.name))
+        write_indented("file \"%s\"" % (texture.filename))
+        write_indented("wrap_s %s" % texture.wrap_s)
+        write_indented("wrap_t %s" % texture.wrap_t)
+
+        write_indented("wrap_r REPEAT")
+        write_indented("min_filter LINEAR_MIPMAP_LINEAR")
+        write_indented("mag_filter LINEAR")
+        write_indented("internalFormatMode USE_IMAGE_DATA_FORMAT")
+        write_indented("subloadMode OFF")
+        write_indented("resizeNonPowerOfTwo TRUE")
 
 
+        close_class()
+        close_class()
+        
 
-    write_indented("num_drawables %d" % len(m.material_slots))
+    close_class()
 
-    for material_slot in m.material_slots:
-        open_class("Geometry")
+def write_primitive_sets(tris, strip, quads):
+    # pick the smallest index type that can address every vertex of the drawable
+    max_index = -1
+    for faces in (tris, quads):
+        if len(faces) > 0:
+            max_index = max(max_index, largest_index(faces))
+    if len(strip) > 0:
+        max_index = max(max_index, max(strip))
+    if max_index > USHORT_INDEX_LIMIT:
+        draw_elements = "DrawElementsUInt"
+    else:
+        draw_elements = "DrawElementsUShort"
+
+    num_primitives = 0
+
+    if len(tris) > 0:
+        num_primitives += 1
+    if len(strip) > 0:
+        num_primitives += 1
+    if len(quads) > 0:
+        num_primitives += 1
+    open_class("PrimitiveSets %d" % num_primitives)
+
+    # draw all the triangle faces
+    if len(tris) > 0:
+        open_class("%s TRIANGLES %d" % (draw_elements, len(tris) * 3))
+        write_rows("%d %d %d", tris)
+        close_class()
+    # or as one triangle strip
+    if len(strip) > 0:
+        open_class("%s TRIANGLE_STRIP %d" % (draw_elements, len(strip)))
+        full_rows = len(strip) - len(strip) % 3
+        write_rows("%d %d %d", [strip[i:i + 3] for i in range(0, full_rows, 3)])
+        if full_rows < len(strip):
+            write_indented(" ".join(["%d" % index for index in strip[full_rows:]]))
+        close_class()
+    # draw all the quad faces
+    if len(quads) > 0:
+        open_class("%s QUADS %d" % (draw_elements, len(quads) * 4))
+        write_rows("%d %d %d %d", quads)
+        close_class()
 
-        # write the material
-        open_class("StateSet")
+    close_class()
 
-        if material_slot.material.alpha < 1.0:
-            write_indented("GL_BLEND ON")
-            write_indented("rendering_hint TRANSPARENT_BIN")
-        else:
-            write_indented("rendering_hint OPAQUE_BIN")
+def write_vertex_arrays(positions, normals, uvs, array_ids, written):
+    # array_ids holds the UniqueIDs of the vertex, normal and texcoord arrays.
+    # Arrays that are already written are only referenced.
+    vertex_array_id, normal_array_id, texcoord_array_id = array_ids
+    if written:
+        write_indented("VertexArray Use %s" % vertex_array_id)
+        write_indented("NormalBinding PER_VERTEX")
+        write_indented("NormalArray Use %s" % normal_array_id)
+        if len(uvs) > 0:
+            write_indented("TexCoordArray 0 Use %s" % texcoord_array_id)
+        return
 
-        open_class("Material")
-        write_indented("name \"%s\"" % material_slot.name)
+    # write the vertices
+    open_class("VertexArray UniqueID %s Vec3Array %d" % (vertex_array_id, len(positions)))
+    write_rows("%f %f %f", positions)
 
-        
-        write_indented("ColorMode OFF")
-        write_indented("ambientColor %f %f %f %f" % (material_slot.material.ambient, 
-                                                     material_slot.material.ambient, 
-                                                     material_slot.material.ambient, 
-                                                     material_slot.material.ambient))
-
-        d = material_slot.material.diffuse_color
-        if material_slot.material.use_object_color:
-            d[0] *= m.color[0]
-            d[1] *= m.color[1]
-            d[2] *= m.color[2]
-
-        write_indented("diffuseColor %f %f %f %f" % (d[0] * material_slot.material.diffuse_intensity,
-                                                     d[1] * material_slot.material.diffuse_intensity,
-                                                     d[2] * material_slot.material.diffuse_intensity,
-                                                     material_slot.material.alpha))
-        
-        write_indented("specularColor %f %f %f %f" % (0,
-                                                     0,
-                                                     0,
-                                                     1))
-    
-        write_indented("emissionColor %f %f %f %f" % (material_slot.material.emit, material_slot.material.emit, material_slot.material.emit, material_slot.material.emit))
-        # Hardness is a value from 1 - 511
-        # The equation below brings it back to the range 0.0 to 10.0
-        write_indented("shininess %f" % ((material_slot.material.specular_hardness - 1.0) / 51.0))
-    
-        close_class()
-        
-        if material_slot.material.active_texture != None and material_slot.material.active_texture.type == 'IMAGE' and material_slot.material.active_texture.image != None:
-            # render the texture to a bitmap
-            image_texture = material_slot.material.active_texture
-            image = image_texture.image
-            filename = os.path.join(os.path.dirname(filepath), os.path.basename(filepath).split(".")[0] + "-" + os.path.basename(image.filepath).split(".")[0] + ".png");
-            original_format = current_scene.render.file_format
-            current_scene.render.file_format = 'PNG'
-            exported = True
-            try:
-                image.save_render(filename, current_scene)
-            except:
-                exported = False
-            current_scene.render.file_format = original_format
-            
-            if exported:
-                open_class("textureUnit 0")
-                write_indented("GL_TEXTURE_2D ON")
-                open_class("Texture2D")
-                write_indented("name \"%s\"" % (image.name))
-                write_indented("file \"%s\"" % (filename))
-                if image_texture.repeat_x > 1:
-                    write_indented("wrap_s REPEAT")
-                else:
-                    write_indented("wrap_s CLAMP")
-                if image_texture.repeat_y > 1:
-                    write_indented("wrap_t REPEAT")
-                else:
-                    write_indented("wrap_t CLAMP")
+    close_class()
 
-                write_indented("wrap_r REPEAT")
-                write_indented("min_filter LINEAR_MIPMAP_LINEAR")
-                write_indented("mag_filter LINEAR")
-                write_indented("internalFormatMode USE_IMAGE_DATA_FORMAT")
-                write_indented("subloadMode OFF")
-                write_indented("resizeNonPowerOfTwo TRUE")
+    # write the normals
+    write_indented("NormalBinding PER_VERTEX")
+    open_class("NormalArray UniqueID %s Vec3Array %d" % (normal_array_id, len(normals)))
+    write_rows("%f %f %f", normals)
 
+    close_class()
+
+    if len(uvs) > 0:
+        open_class("TexCoordArray 0 UniqueID %s Vec2Array %d" % (texcoord_array_id, len(uvs)))
 
-                close_class()
-                close_class()
-            
 
+        write_rows("%f %f", uvs)
         close_class()
 
+def split_primitives(tris, quads, positions, normals, uvs, vertex_sources, limit):
+    # Split the faces into chunks that each reference at most limit vertices.
+    # The faces are handed out in the order of their lowest mesh vertex, so the faces of a
+    # chunk lie next to each other on the mesh and few vertices are written in two chunks.
+    # Within a chunk they keep their given order, which may be the vertex cache order.
+    # Every chunk gets its own compacted arrays: (tris, quads, positions, normals, uvs).
+    faces = tris + quads
+    sources = as_list(vertex_sources)
+    face_order = sorted(range(len(faces)), key=lambda face_index: min([sources[index] for index in faces[face_index]]))
+
+    chunk_faces = []
+    chunk = []
+    chunk_vertices = set()
+    for face_index in face_order:
+        indices = faces[face_index]
+        new_vertices = set(index for index in indices if index not in chunk_vertices)
+        if len(chunk_vertices) + len(new_vertices) > limit:
+            chunk_faces.append(chunk)
+            chunk = []
+            chunk_vertices = set()
+        chunk.append(face_index)
+        chunk_vertices.update(indices)
+
+    if len(chunk) > 0:
+        chunk_faces.append(chunk)
+
+    chunks = []
+    for chunk in chunk_faces:
+        remap = {}
+        order = []
+        chunk_tris = []
+        chunk_quads = []
+        for face_index in sorted(chunk):
+            local_indices = []
+            for index in faces[face_index]:
+                if index not in remap:
+                    remap[index] = len(order)
+                    order.append(index)
+                local_indices.append(remap[index])
+            if face_index < len(tris):
+                chunk_tris.append(local_indices)
+            else:
+                chunk_quads.append(local_indices)
+
+        chunk_uvs = uvs
+        if len(uvs) > 0:
+            chunk_uvs = take(uvs, order)
+        chunks.append((chunk_tris, chunk_quads, take(positions, order), take(normals, order), chunk_uvs))
+    return chunks
+
+def count_cache_misses(indices, cache_size):
+    # simulate a FIFO post-transform vertex cache over the index stream
+    cache = []
+    cached = set()
+    misses = 0
+    for index in indices:
+        if index in cached:
+            continue
+        misses += 1
+        cache.append(index)
+        cached.add(index)
+        if len(cache) > cache_size:
+            cached.discard(cache.pop(0))
+    return misses
+
+def count_strip_triangles(strip):
+    # number of triangles a strip draws, without the degenerate stitching triangles
+    return len([i for i in range(len(strip) - 2) if len(set(strip[i:i + 3])) == 3])
+
+def compute_acmr(tris, strip):
+    # average cache miss ratio: transformed vertices per drawn triangle
+    if len(strip) > 0:
+        return count_cache_misses(strip, VERTEX_CACHE_SIZE) / float(max(count_strip_triangles(strip), 1))
+    indices = [index for indices in tris for index in indices]
+    return count_cache_misses(indices, VERTEX_CACHE_SIZE) / float(max(len(tris), 1))
+
+def vertex_cache_score(cache_position, remaining):
+    # vertex score from Tom Forsyth's "Linear-Speed Vertex Cache Optimisation"
+    if remaining == 0:
+        return -1.0
+    score = 0.0
+    if cache_position >= 0:
+        if cache_position < 3:
+            # the vertices of the last triangle get a fixed score so it is not reused straight away
+            score = 0.75
+        else:
+            score = (1.0 - (cache_position - 3) / float(VERTEX_CACHE_SIZE - 3)) ** 1.5
+    # boost vertices with few triangles left so they are finished off
+    score += 2.0 * remaining ** -0.5
+    return score
+
+def optimize_triangle_order(tris):
+    # reorder the triangles for post-transform vertex cache locality (Forsyth)
+    vertex_tris = {}
+    for tri_index, indices in enumerate(tris):
+        for index in indices:
+            if index in vertex_tris:
+                vertex_tris[index].append(tri_index)
+            else:
+                vertex_tris[index] = [tri_index]
+
+    vertex_score = {}
+    for index, index_tris in vertex_tris.items():
+        vertex_score[index] = vertex_cache_score(-1, len(index_tris))
+    tri_score = [sum(vertex_score[index] for index in indices) for indices in tris]
+    tri_added = [False] * len(tris)
+
+    ordered = []
+    cache = []
+    next_unadded = 0
+    best_tri = -1
+    while len(ordered) < len(tris):
+        if best_tri < 0:
+            # nothing useful in the cache, continue with the next triangle in the original order
+            while tri_added[next_unadded]:
+                next_unadded += 1
+            best_tri = next_unadded
+
+        tri_added[best_tri] = True
+        ordered.append(tris[best_tri])
+        for index in tris[best_tri]:
+            vertex_tris[index].remove(best_tri)
+
+        # move the triangle's vertices to the front of the cache
+        cache = list(tris[best_tri]) + [index for index in cache if index not in tris[best_tri]]
+        evicted = cache[VERTEX_CACHE_SIZE:]
+        cache = cache[:VERTEX_CACHE_SIZE]
+
+        touched = set()
+        for cache_position, index in enumerate(cache):
+            vertex_score[index] = vertex_cache_score(cache_position, len(vertex_tris[index]))
+            touched.update(vertex_tris[index])
+        for index in evicted:
+            vertex_score[index] = vertex_cache_score(-1, len(vertex_tris[index]))
+            touched.update(vertex_tris[index])
+
+        best_tri = -1
+        best_score = -1.0
+        for tri_index in touched:
+            tri_score[tri_index] = sum(vertex_score[index] for index in tris[tri_index])
+            if tri_score[tri_index] > best_score:
+                best_score = tri_score[tri_index]
+                best_tri = tri_index
+
+    return ordered
+
+def reorder_vertices(face_lists, positions, normals, uvs, vertex_sources):
+    # renumber the vertices in the order the faces first use them so the
+    # vertex fetches follow the index order
+    remap = {}
+    for faces in face_lists:
+        for indices in faces:
+            for index in indices:
+                if index not in remap:
+                    remap[index] = len(remap)
+    for index in range(len(positions)):
+        if index not in remap:
+            remap[index] = len(remap)
+
+    order = [0] * len(positions)
+    for index, new_index in remap.items():
+        order[new_index] = index
+
+    positions = take(positions, order)
+    normals = take(normals, order)
+    if len(uvs) > 0:
+        uvs = take(uvs, order)
+    vertex_sources = take(vertex_sources, order)
+    face_lists = [[[remap[index] for index in indices] for indices in faces] for faces in face_lists]
+    return face_lists, positions, normals, uvs, vertex_sources
+
+def build_triangle_strip(tris):
+    # Greedily walk the triangles into strips and stitch them into a single
+    # strip with degenerate triangles. The winding of every triangle is kept.
+    edge_tris = {}
+    for tri_index, (a, b, c) in enumerate(tris):
+        for edge in ((a, b), (b, c), (c, a)):
+            if edge in edge_tris:
+                edge_tris[edge].append(tri_index)
+            else:
+                edge_tris[edge] = [tri_index]
+
+    def unused_neighbour(edge):
+        for tri_index in edge_tris.get(edge, []):
+            if not tri_used[tri_index]:
+                return tri_index
+        return -1
+
+    def third_vertex(tri_index, edge):
+        for index in tris[tri_index]:
+            if index != edge[0] and index != edge[1]:
+                return index
+        return -1
+
+    tri_used = [False] * len(tris)
+    strip = []
+    for start, (a, b, c) in enumerate(tris):
+        if tri_used[start]:
+            continue
+        tri_used[start] = True
+
+        # start with the rotation that has a neighbour to continue into
+        for rotation in ((a, b, c), (b, c, a), (c, a, b)):
+            if unused_neighbour((rotation[2], rotation[1])) >= 0:
+                break
+        current = list(rotation)
+
+        while True:
+            # the next triangle (in strip position len(current) - 2) needs the
+            # shared edge in the direction that matches the strip's winding
+            if len(current) % 2 == 1:
+                edge = (current[-1], current[-2])
+            else:
+                edge = (current[-2], current[-1])
+            tri_index = unused_neighbour(edge)
+            if tri_index < 0:
+                break
+            vertex = third_vertex(tri_index, edge)
+            if vertex < 0:
+                break
+            tri_used[tri_index] = True
+            current.append(vertex)
+
+        if len(strip) > 0:
+            # keep each strip starting on an even position so the winding is unchanged
+            if len(strip) % 2 == 1:
+                strip.append(strip[-1])
+            strip.append(strip[-1])
+            strip.append(current[0])
+        strip.extend(current)
+
+    return strip
+
+def mesh_arrays_digest(mesh_arrays):
+    digest = hashlib.sha1()
+    for values in mesh_arrays:
+        if values is None:
+            digest.update(b"-")
+        elif numpy is not None and isinstance(values, numpy.ndarray):
+            digest.update(values.tobytes())
+        else:
+            digest.update(array.array('d', values).tobytes())
+    return digest.hexdigest()
+
+def get_geometry_key(m, mesh_arrays):
+    # Objects with the same key write the same Geode: the same mesh data, the same
+    # modifier result (the digest of the evaluated arrays, None without modifiers)
+    # and the same materials
+    materials = tuple((material_slot.name, material_slot.material) for material_slot in m.material_slots)
+    if any(material_slot.material.use_object_color for material_slot in m.material_slots):
+        materials += (tuple(m.color),)
+    if mesh_arrays is None:
+        return (m.data, None, materials)
+    return (m.data, mesh_arrays_digest(mesh_arrays), materials)
 
-        num_primitives = 0
-
-        if num_tris > 0:
-            num_primitives += 1
-        if num_quads > 0:
-            num_primitives += 1
-        open_class("PrimitiveSets %d" % num_primitives)
-
-        # draw all the triangle faces
-        uv_coords = {} 
-        # write the texture coordinates
-        texture_face_layer = modified_mesh.uv_textures.active
-        if texture_face_layer != None:
-            for face_index, texture_face in enumerate(texture_face_layer.data):
-                uv_coords[face_index] = []
-                for vertex in texture_face.uv:
-                    uv_coords[face_index].append((vertex[0], vertex[1]))
-
-        vertex_index = 0
-        uv_reordered = []
-        if num_tris > 0:
-            open_class("DrawElementsUShort TRIANGLES %d" % (num_tris * 3))
-            for face_index, face in enumerate(modified_mesh.faces):
-                if len(face.vertices) == 3:
-                    if face.material_index == material_index:
-                        write_indented("%d %d %d" % (vertex_index, vertex_index + 1, vertex_index + 2))
-                        if len(uv_coords) > 0:
-                            uv_reordered.append(uv_coords[face_index][0])
-                            uv_reordered.append(uv_coords[face_index][1])
-                            uv_reordered.append(uv_coords[face_index][2])
-                    vertex_index += 3
+def write_mesh(m, recursive, animation):
+    global current_scene, export_animations, orphan_meshes, shared_instances
+
+    orphan_meshes.discard(m)
+    rig = animation and export_animations
+
+    # linked duplicates write their geometry once and reference it from then on,
+    # rigged meshes are bound to their own skeleton and always get their own Geode
+    modified_mesh = None
+    mesh_arrays = None
+    geode_id = None
+    if not rig and mesh_data_users.get(m.data, 0) > 1:
+        if apply_modifiers and any(modifier.show_render for modifier in m.modifiers):
+            start = time.time()
+            modified_mesh = m.to_mesh(current_scene, apply_modifiers, 'RENDER')
+            add_time("to_mesh", start, m.name)
+            start = time.time()
+            mesh_arrays = extract_mesh_arrays(modified_mesh)
+            add_time("flatten", start, m.name)
+        geometry_key = get_geometry_key(m, mesh_arrays)
+        if geometry_key in shared_geodes:
+            write_indented("Use %s" % shared_geodes[geometry_key])
+            shared_instances += 1
+            release_mesh(modified_mesh)
+        else:
+            geode_id = create_unique_id("Geode")
+            shared_geodes[geometry_key] = geode_id
+            write_geode(m, rig, modified_mesh, mesh_arrays, geode_id)
+    else:
+        write_geode(m, rig, modified_mesh, mesh_arrays, geode_id)
+    # not kept alive while the children are written
+    modified_mesh = mesh_arrays = None
 
-            close_class()
-        # draw all the quad faces
-        if num_quads > 0:
-            open_class("DrawElementsUShort QUADS %d" % (num_quads * 4))
-            for face_index, face in enumerate(modified_mesh.faces):
-                if len(face.vertices) == 4:
-                    if face.material_index == material_index:
-                        write_indented("%d %d %d %d" % (vertex_index, vertex_index + 1, vertex_index + 2, vertex_index + 3))
-                        if len(uv_coords) > 0:
-                            uv_reordered.append(uv_coords[face_index][0])
-                            uv_reordered.append(uv_coords[face_index][1])
-                            uv_reordered.append(uv_coords[face_index][2])
-                            uv_reordered.append(uv_coords[face_index][3])
-                    vertex_index += 4
+    if recursive:
+        child_meshes = find_mesh_child_meshes(m)
+        for child_mesh in child_meshes:
+            
+            open_class("MatrixTransform")
+            m = child_mesh.matrix_local.copy()
+
+            write_matrix(m)
+            write_mesh(child_mesh, True, animation)
             close_class()
 
-        close_class()
+def rna_values(data):
+    # the plain property values of a bpy struct, pointers by name
+    values = []
+    for prop in data.bl_rna.properties:
+        if prop.identifier == 'rna_type' or prop.type == 'COLLECTION':
+            continue
+        value = getattr(data, prop.identifier, None)
+        if prop.type == 'POINTER':
+            value = getattr(value, "name", None)
+        elif getattr(prop, "array_length", 0) > 0:
+            value = tuple(value)
+        values.append((prop.identifier, value))
+    return values
+
+def geode_fingerprint(m, rig, modified_mesh, mesh_arrays):
+    # Hash of everything the Geode of m is written from: the mesh, the materials and
+    # the export options. Shape keys and modifiers can depend on other objects, vertex
+    # groups and textures, so for them the mesh evaluated by to_mesh is hashed.
+    # Returns the hash, the evaluated mesh (None when m.data is hashed as it is) and the
+    # hashed arrays, which are read from m.data when there is no evaluated mesh.
+    digest = hashlib.sha1()
+
+    def add(*values):
+        digest.update(repr(values).encode("utf-8"))
+
+    add(FRAGMENT_CACHE_VERSION, emitter.__class__.__name__, m.name, rig, apply_modifiers, weld_vertices, weld_epsilon,
+        index_mode, optimize_vertex_cache, triangle_strips)
+
+    if modified_mesh is None and (m.data.shape_keys != None or apply_modifiers and len(m.modifiers) > 0):
+        start = time.time()
+        modified_mesh = m.to_mesh(current_scene, apply_modifiers, 'RENDER')
+        add_time("to_mesh", start, m.name)
+    if modified_mesh != None:
+        if mesh_arrays is None:
+            start = time.time()
+            mesh_arrays = extract_mesh_arrays(modified_mesh)
+            add_time("flatten", start, m.name)
+        add(mesh_arrays_digest(mesh_arrays))
+        weighted_mesh = modified_mesh
+    else:
+        start = time.time()
+        mesh_arrays = extract_mesh_arrays(m.data)
+        add_time("flatten", start, m.name)
+        add(mesh_arrays_digest(mesh_arrays))
+        weighted_mesh = m.data
 
-        # write the vertices
-        open_class("VertexArray Vec3Array %d" % len(vertices))
-        for vertex in vertices:
-            write_indented("%f %f %f" % (vertex.co[0], vertex.co[1], vertex.co[2]))
-    
-        close_class()
+    if rig:
+        add([(vertex_group.index, vertex_group.name) for vertex_group in m.vertex_groups])
+        add([[(g.group, g.weight) for g in vertex.groups] for vertex in weighted_mesh.vertices])
 
-        # write the normals
-        write_indented("NormalBinding PER_VERTEX")
-        open_class("NormalArray Vec3Array %d" % len(vertices))
-        for vertex in vertices:
-            write_indented("%f %f %f" % (vertex.normal[0], vertex.normal[1], vertex.normal[2]));
+    for material_slot in m.material_slots:
+        material = material_slot.material
+        add(material_slot.name, rna_values(material))
+        if material.use_object_color:
+            add(tuple(m.color))
+        texture = material.active_texture
+        if texture != None and texture.type == 'IMAGE' and texture.image != None:
+            # the textures are written whether the Geode is cached or not
+            add(texture.image.name, texture.repeat_x, texture.repeat_y, export_image(texture.image))
+
+    return digest.hexdigest(), modified_mesh, mesh_arrays
+
+def start_fragment_cache():
+    # fragments of the previous export of filepath, and the ones this export uses
+    global fragment_cache_path, used_fragments, reused_fragments
+    fragment_cache_path = os.path.join(os.path.dirname(filepath), "." + os.path.basename(filepath) + FRAGMENT_CACHE_SUFFIX)
+    used_fragments = set()
+    reused_fragments = 0
+    if not os.path.isdir(fragment_cache_path):
+        os.makedirs(fragment_cache_path)
+
+def finish_fragment_cache():
+    # fragments this export did not use belong to objects that changed or are gone
+    for name in os.listdir(fragment_cache_path):
+        if name not in used_fragments:
+            os.remove(os.path.join(fragment_cache_path, name))
+    print("%d cached fragments, %d reused" % (len(used_fragments), reused_fragments))
+
+def load_fragment(key):
+    try:
+        with open(os.path.join(fragment_cache_path, key), 'rb') as fragment_file:
+            return pickle.loads(zlib.decompress(fragment_file.read()))
+    except (IOError, OSError, ValueError, EOFError, zlib.error, pickle.UnpicklingError):
+        return None
+
+def store_fragment(key, fragment):
+    try:
+        with open(os.path.join(fragment_cache_path, key), 'wb') as fragment_file:
+            fragment_file.write(zlib.compress(pickle.dumps(fragment, pickle.HIGHEST_PROTOCOL), 1))
+    except (IOError, OSError):
+        print("Warning: could not write the cached fragment %s" % key)
+
+unique_id_pattern = re.compile(r"\b(UniqueID|Use) (\w+)_(\d+)\b")
+
+def remap_unique_ids(first_id, offset):
+    # moves the UniqueIDs a cached fragment created, first_id and up, by offset
+    def remap(match):
+        number = int(match.group(3))
+        if number < first_id:
+            return match.group(0)
+        return "%s %s_%d" % (match.group(1), match.group(2), number + offset)
+    return lambda s: unique_id_pattern.sub(remap, s)
+
+def write_geode(m, rig, modified_mesh, mesh_arrays, geode_id):
+    global unique_id_count, reused_fragments
+    start = time.time()
+    open_class("Geode")
+    if geode_id != None:
+        # the UniqueID has to come first for the osg reader
+        write_indented("UniqueID %s" % geode_id)
 
+    if not incremental:
+        write_geode_body(m, rig, modified_mesh, mesh_arrays)
         close_class()
+        add_time("geode", start, m.name)
+        return
+
+    key, modified_mesh, mesh_arrays = geode_fingerprint(m, rig, modified_mesh, mesh_arrays)
+    used_fragments.add(key)
+    cached = load_fragment(key)
+    if cached != None:
+        # splice the fragment in, renumbering the UniqueIDs it created
+        first_id, num_ids, fragment = cached
+        remap = None
+        if first_id != unique_id_count + 1:
+            remap = remap_unique_ids(first_id, unique_id_count + 1 - first_id)
+        emitter.write_fragment(fragment, remap)
+        unique_id_count += num_ids
+        reused_fragments += 1
+        add_count("cached_geodes", 1, m.name)
+        release_mesh(modified_mesh)
+    else:
+        first_id = unique_id_count + 1
+        emitter.begin_fragment()
+        write_geode_body(m, rig, modified_mesh, mesh_arrays)
+        fragment = emitter.end_fragment()
+        store_fragment(key, (first_id, unique_id_count + 1 - first_id, fragment))
+
+    close_class()
+    add_time("geode", start, m.name)
+
+def write_geode_body(m, rig, modified_mesh, mesh_arrays):
+    # With a serialization pool the Geode is only extracted here, its calls are
+    # recorded and formatted by a worker process while the next object is read
+    global emitter
+    if serialize_pool is None:
+        write_geode_contents(extract_mesh(m, rig, modified_mesh, mesh_arrays))
+        return
 
-        if len(uv_reordered) > 0:
-            open_class("TexCoordArray 0 Vec2Array %d" % len(uv_reordered))
+    mesh = extract_mesh(m, rig, modified_mesh, mesh_arrays)
+    target = emitter
+    emitter = OSGRecorder()
+    try:
+        write_geode_contents(mesh)
+    finally:
+        recorder = emitter
+        emitter = target
+
+    if recorder.rows < SERIALIZE_MIN_ROWS:
+        recorder.replay(emitter)
+    else:
+        emitter.write_deferred(serialize_pool.submit(format_ops, recorder.ops, emitter.indent_level), 2 * serialize_pool_size)
 
+def start_serialize_pool(workers):
+    global serialize_pool, serialize_pool_size
+    serialize_pool = None
+    serialize_pool_size = workers
+    if workers <= 0:
+        return
+    # started before any other thread of the export runs, spawned workers would have to import bpy
+    serialize_pool = fork_process_pool(workers)
+    if serialize_pool is None:
+        print("Warning: serialization processes need fork, serializing on one core.")
+
+class MeshData(object):
+    '''Everything the Geode of one object is written from, read out of blender in one pass.
+    The vertex arrays and face indices are NumPy arrays when NumPy is available. The vertex group weights
+    of source vertex i are weight_groups and weight_values[weight_offsets[i]:weight_offsets[i + 1]].'''
+    __slots__ = ("name", "rig", "positions", "normals", "uvs", "vertex_sources", "bucket_indices", "materials",
+                 "vertex_groups", "weight_offsets", "weight_groups", "weight_values")
+
+def extract_mesh(m, rig, modified_mesh, mesh_arrays):
+    # the geometry, materials and weights of m, modified_mesh and mesh_arrays when already read.
+    # mesh_arrays without modified_mesh are those of m.data, which has nothing to evaluate.
+    mesh = MeshData()
+    mesh.name = m.name
+    mesh.rig = rig
+
+    if modified_mesh is None and mesh_arrays is None:
+        start = time.time()
+        modified_mesh = m.to_mesh(current_scene, apply_modifiers, 'RENDER')
+        add_time("to_mesh", start, m.name)
+    weighted_mesh = modified_mesh if modified_mesh != None else m.data
+
+    # flatten the primitives into indexed vertex arrays
+    start = time.time()
+    if mesh_arrays is None:
+        mesh_arrays = extract_mesh_arrays(modified_mesh)
+    mesh.positions, mesh.normals, mesh.uvs, mesh.vertex_sources, mesh.bucket_indices = build_vertex_arrays(mesh_arrays, weld_vertices, weld_epsilon, rig)
+    add_time("flatten", start, m.name)
+    add_count("vertices", len(mesh.positions), m.name)
+    add_count("faces", len(mesh_arrays[3]), m.name)
+
+    mesh.materials = [extract_material(m, material_slot) for material_slot in m.material_slots]
+
+    mesh.vertex_groups = []
+    if rig:
+        # the memberships of every vertex in the vertex groups of the object
+        start = time.time()
+        mesh.vertex_groups = [(vertex_group.index, vertex_group.name) for vertex_group in m.vertex_groups]
+        group_indices = set([index for index, name in mesh.vertex_groups])
+        mesh.weight_offsets = array.array('i', [0])
+        mesh.weight_groups = array.array('i')
+        mesh.weight_values = array.array('d')
+        for vertex in weighted_mesh.vertices:
+            for g in vertex.groups:
+                if g.group in group_indices:
+                    mesh.weight_groups.append(g.group)
+                    mesh.weight_values.append(g.weight)
+            mesh.weight_offsets.append(len(mesh.weight_groups))
+        add_time("weights", start, m.name)
+
+    release_mesh(modified_mesh)
+    return mesh
+
+def release_mesh(modified_mesh):
+    # the evaluated mesh is freed as soon as it is read in streaming mode,
+    # otherwise it stays in bpy.data until blender is closed
+    if streaming and modified_mesh != None:
+        start = time.time()
+        bpy.data.meshes.remove(modified_mesh)
+        add_time("to_mesh", start)
+
+def write_geode_contents(mesh):
+    write_indented("name \"%s\"" % mesh.name)
+    # count the drawables
+    # draw each material as a separate geometry - but they all share the same vertex and normal lists
+
+    rig = mesh.rig
+    positions, normals, uvs, vertex_sources = mesh.positions, mesh.normals, mesh.uvs, mesh.vertex_sources
+
+    split = index_mode == 'SPLIT' and len(positions) > USHORT_INDEX_LIMIT + 1 and not rig
+    material_tris = [mesh.bucket_indices.get((material_index, 3), []) for material_index in range(len(mesh.materials))]
+    material_quads = [mesh.bucket_indices.get((material_index, 4), []) for material_index in range(len(mesh.materials))]
+    if optimize_vertex_cache or split or triangle_strips:
+        # the faces stay arrays up to the writer unless they are reordered, split or stripped
+        material_tris = [as_list(tris) for tris in material_tris]
+        material_quads = [as_list(quads) for quads in material_quads]
+
+    if optimize_vertex_cache:
+        # the ACMR is compared on the triangle lists of the materials, each one is drawn with a cold cache
+        start = time.time()
+        num_tris = max(sum([len(tris) for tris in material_tris]), 1)
+        acmr_before = sum([compute_acmr(tris, []) * len(tris) for tris in material_tris]) / num_tris
+        material_tris = [optimize_triangle_order(tris) for tris in material_tris]
+        acmr_after = sum([compute_acmr(tris, []) * len(tris) for tris in material_tris]) / num_tris
+        print("%s: ACMR %.3f before, %.3f after vertex cache optimization" % (mesh.name, acmr_before, acmr_after))
+        face_lists, positions, normals, uvs, vertex_sources = reorder_vertices(material_tris + material_quads, positions, normals, uvs, vertex_sources)
+        material_tris = face_lists[:len(material_tris)]
+        material_quads = face_lists[len(material_tris):]
+        add_time("optimize", start, mesh.name)
+
+    shared_array_ids = (create_unique_id("VertexArray"), create_unique_id("NormalArray"), create_unique_id("TexCoordArray"))
+
+    # work out the drawables: (material, tris, strip, quads, positions, normals, uvs, array_ids)
+    drawables = []
+    for material_index, material in enumerate(mesh.materials):
+        tris = material_tris[material_index]
+        quads = material_quads[material_index]
+
+        if split:
+            for chunk_tris, chunk_quads, chunk_positions, chunk_normals, chunk_uvs in split_primitives(tris, quads, positions, normals, uvs, vertex_sources, USHORT_INDEX_LIMIT + 1):
+                array_ids = (create_unique_id("VertexArray"), create_unique_id("NormalArray"), create_unique_id("TexCoordArray"))
+                drawables.append([material, chunk_tris, [], chunk_quads, chunk_positions, chunk_normals, chunk_uvs, array_ids])
+        else:
+            drawables.append([material, tris, [], quads, positions, normals, uvs, shared_array_ids])
+
+    if triangle_strips:
+        # only use the strip where it needs fewer indices than the triangle list
+        start = time.time()
+        for drawable in drawables:
+            strip = build_triangle_strip(drawable[1])
+            if len(strip) < len(drawable[1]) * 3:
+                drawable[1] = []
+                drawable[2] = strip
+        add_time("optimize", start, mesh.name)
+
+    if len(positions) <= USHORT_INDEX_LIMIT + 1:
+        print("%s: %d vertices, 16 bit indices" % (mesh.name, len(positions)))
+    elif split:
+        print("%s: %d vertices, split into %d drawables with 16 bit indices" % (mesh.name, len(positions), len(drawables)))
+    elif rig:
+        print("%s: %d vertices, 32 bit indices (rigged meshes can not be split)" % (mesh.name, len(positions)))
+    else:
+        print("%s: %d vertices, 32 bit indices" % (mesh.name, len(positions)))
 
-            for uv in uv_reordered:
-                write_indented("%f %f" % (uv[0], uv[1]));
+    if rig:
+        # TODO - wrap the geometry in a rig geometry
+        write_indented("num_drawables 1")
+        open_class("osgAnimation::RigGeometry")
+        write_indented("name \"%s\"" % (mesh.name))
+
+        # export the vertex groups, inverting the vertex -> group memberships in one
+        # pass. Vertices split from the same source vertex share its memberships.
+        influences = dict((index, []) for index, name in mesh.vertex_groups)
+        offsets, groups, values = mesh.weight_offsets, mesh.weight_groups, mesh.weight_values
+        for index, source in enumerate(as_list(vertex_sources)):
+            for membership in range(offsets[source], offsets[source + 1]):
+                influences[groups[membership]].append((index, values[membership]))
+
+        write_indented("num_influences %d" % (len(mesh.vertex_groups)))
+        for group_index, group_name in mesh.vertex_groups:
+            weights = influences[group_index]
+            open_class("osgAnimation::VertexInfluence \"%s\" %d" % (group_name, len(weights)))
+            write_rows("%d %f", weights)
             close_class()
 
 
+
+    write_indented("num_drawables %d" % len(drawables))
+
+    written_arrays = set()
+    for material, tris, strip, quads, drawable_positions, drawable_normals, drawable_uvs, array_ids in drawables:
+        open_class("Geometry")
+
+        write_material(material)
+        write_primitive_sets(tris, strip, quads)
+
+        # shared arrays are written once with the first drawable, the others reference them
+        write_vertex_arrays(drawable_positions, drawable_normals, drawable_uvs, array_ids, array_ids in written_arrays)
+        written_arrays.add(array_ids)
+
         close_class()
-        material_index += 1
     
-    if animation and export_animations:
+    if rig:
         # TODO - wrap the geometry in a rig geometry
         close_class()
 
-    close_class()
-
-    if recursive:
-        child_meshes = find_mesh_child_meshes(m)
-        for child_mesh in child_meshes:
-            
-            open_class("MatrixTransform")
-            m = child_mesh.matrix_local.copy()
-
-            write_matrix(m)
-            write_mesh(child_mesh, True, animation)
-            close_class()
-
 def write_identity_matrix():
     open_class("Matrix")
     m = mathutils.Matrix()
     m.identity()
-    write_indented("%f %f %f %f" % (m[0][0], m[0][1], m[0][2], m[0][3]))
-    write_indented("%f %f %f %f" % (m[1][0], m[1][1], m[1][2], m[1][3]))
-    write_indented("%f %f %f %f" % (m[2][0], m[2][1], m[2][2], m[2][3]))
-    write_indented("%f %f %f %f" % (m[3][0], m[3][1], m[3][2], m[3][3]))
+    write_matrix_rows(m)
     
     close_class()
     write_indented("num_children 1")
@@ -354,101 +2305,100 @@ def write_identity_matrix():
 def write_delta_matrix(o):
     open_class("Matrix")
     m = o.matrix_local.copy()
-    write_indented("%f %f %f %f" % (m[0][0], m[0][1], m[0][2], m[0][3]))
-    write_indented("%f %f %f %f" % (m[1][0], m[1][1], m[1][2], m[1][3]))
-    write_indented("%f %f %f %f" % (m[2][0], m[2][1], m[2][2], m[2][3]))
-    write_indented("%f %f %f %f" % (m[3][0], m[3][1], m[3][2], m[3][3]))
+    write_matrix_rows(m)
     
     close_class()
     write_indented("num_children 1")
 
-def find_armature_child_meshes(armature):
-    global current_scene
-    child_meshes = []
-    for o in current_scene.objects:
-        if o.type == 'MESH':
-            for m in o.modifiers:
-                if m.type == "ARMATURE":
-                    if m.object == armature:
-                        child_meshes.append(o)
+def index_scene_meshes(s):
+    # build the parent -> child meshes, bone name -> meshes and armature -> skinned
+    # meshes maps once per scene, so walking the hierarchy needs no scans of all objects
+    global mesh_child_meshes, bone_child_meshes, armature_child_meshes, mesh_data_users, shared_geodes, shared_instances
+    mesh_child_meshes = {}
+    bone_child_meshes = {}
+    armature_child_meshes = {}
+    # number of objects using each mesh data, the Geodes written for linked duplicates
+    # and the number of objects that reference one of them
+    mesh_data_users = {}
+    shared_geodes = {}
+    shared_instances = 0
+    for o in s.objects:
+        if o.type != 'MESH':
+            continue
+        mesh_data_users[o.data] = mesh_data_users.get(o.data, 0) + 1
+        if o.parent:
+            mesh_child_meshes.setdefault(o.parent, []).append(o)
+        if o.parent_type == 'BONE':
+            bone_child_meshes.setdefault(o.parent_bone, []).append(o)
+        for m in o.modifiers:
+            if m.type == "ARMATURE" and m.object:
+                armature_child_meshes.setdefault(m.object, []).append(o)
 
-    return child_meshes
+def find_armature_child_meshes(armature):
+    return armature_child_meshes.get(armature, [])
 
 def find_mesh_child_meshes(mesh):
-    global current_scene
-    child_meshes = []
-    for o in current_scene.objects:
-        if o.type == 'MESH' and o.parent == mesh:
-            child_meshes.append(o)
-
-    return child_meshes
+    return mesh_child_meshes.get(mesh, [])
 
 def find_bone_child_meshes(bone):
-    global current_scene
-    child_meshes = []
-    for o in current_scene.objects:
-        if o.type == 'MESH' and o.parent_type == 'BONE' and o.parent_bone == bone.name:
-            child_meshes.append(o)
+    return bone_child_meshes.get(bone.name, [])
 
-    return child_meshes
 
+class SkeletonData(object):
+    '''An armature object in its rest pose, the root bones hold the rest of the bone hierarchy'''
+    __slots__ = ("name", "matrix", "bones")
 
-def write_bone(bone, armature_matrix):
-    open_class("osgAnimation::Bone")
-    write_indented("name \"%s\"" % (bone.name))
+class BoneData(object):
+    '''A pose bone with its bind matrix relative to the parent bone and its inverse bind matrix in skeleton space'''
+    __slots__ = ("name", "bind_matrix", "inverse_bind_matrix", "children")
 
-    open_class("UpdateCallbacks")
+def extract_skeleton(obj):
+    # the bone hierarchy of armature object obj, whose pose_position is REST while it is read
+    skeleton = SkeletonData()
+    skeleton.name = obj.data.name
+    skeleton.matrix = obj.matrix_world.copy()
 
-    open_class("osgAnimation::UpdateBone")
-    write_indented("name \"%s\"" % (bone.name))
-
-    open_class("osgAnimation::StackedMatrixElement")
-    write_indented("name \"bindmatrix\"")
+    root_bones = []
+    for bone in obj.pose.bones:
+        m = mathutils.Matrix()
+        m.identity()
+        bone.matrix = m
+        # only add the root bones
+        if bone.parent == None:
+            root_bones.append(bone)
+    skeleton.bones = [extract_bone(bone) for bone in root_bones]
+    return skeleton
 
-    open_class("Matrix")
-    # if bone.parent:
-    #     matrix_relative = bone.matrix_local * bone.parent.matrix_local.inverted()
-    # else:
-    #     matrix_relative = bone.matrix_local.copy()
+def extract_bone(bone):
+    data = BoneData()
+    data.name = bone.name
 
-    rotate = False
     bone_matrix = bone.matrix.copy()
-    bone_rotation = bone.rotation_quaternion
-
-    euler = bone_rotation.to_euler()
-    # reorder euler
-    #t = euler.x
-    #euler.x = euler.y
-    #euler.y = -t
-
-    bone_rotation = euler.to_quaternion()
-    # do something with bone rotation
-    # create a test case
-    #bone_matrix = bone_matrix * bone_rotation.to_matrix().to_4x4()
-    #bone_matrix = bone_rotation.to_matrix().to_4x4() * bone_matrix
     if bone.parent:
-        # candidates here are
-        # parent.matrix
-        # parent.matrix_basis
-        # parent.matrix_channel
-        # parent.bone.matrix_local - no
-        # parent.bone.matrix - 3x3 ?
-        # parent_matrix = bone.parent.bone.matrix_local.copy()
-        # parent_matrix = bone.parent.matrix.copy() strangely close - i think the position was off
+        # candidates for the parent matrix were parent.matrix_basis, parent.matrix_channel and
+        # parent.bone.matrix_local, parent.matrix is the one that puts the bone in place
         parent_matrix = bone.parent.matrix.copy()
-        if rotate:
-            parent_matrix = parent_matrix * mathutils.Matrix.Rotation(math.radians(90), 4, 'Z')
         bone_matrix = parent_matrix.inverted() * bone_matrix
+    data.bind_matrix = bone_matrix
+    data.inverse_bind_matrix = bone.matrix.copy().inverted()
 
-    if rotate:
-        bone_matrix = bone_matrix * mathutils.Matrix.Rotation(math.radians(90), 4, 'Z')
+    data.children = [extract_bone(child) for child in bone.children]
+    return data
+
+def write_bone(bone):
+    open_class("osgAnimation::Bone")
+    write_indented("name \"%s\"" % (bone.name))
+
+    open_class("UpdateCallbacks")
 
+    open_class("osgAnimation::UpdateBone")
+    write_indented("name \"%s\"" % (bone.name))
 
+    open_class("osgAnimation::StackedMatrixElement")
+    write_indented("name \"bindmatrix\"")
 
-    write_indented("%f %f %f %f" % (bone_matrix[0][0], bone_matrix[0][1], bone_matrix[0][2], bone_matrix[0][3]))
-    write_indented("%f %f %f %f" % (bone_matrix[1][0], bone_matrix[1][1], bone_matrix[1][2], bone_matrix[1][3]))
-    write_indented("%f %f %f %f" % (bone_matrix[2][0], bone_matrix[2][1], bone_matrix[2][2], bone_matrix[2][3]))
-    write_indented("%f %f %f %f" % (bone_matrix[3][0], bone_matrix[3][1], bone_matrix[3][2], bone_matrix[3][3]))
+    open_class("Matrix")
+    write_matrix_rows(bone.bind_matrix)
     close_class()
     close_class()
 
@@ -469,16 +2419,7 @@ def write_bone(bone, armature_matrix):
     close_class()
     
     open_class("InvBindMatrixInSkeletonSpace")
-
-    # inverse_bind_matrix = bone.matrix_local.inverted()
-    # bind_matrix = bone.matrix.copy() * bone_rotation.to_matrix().to_4x4() 
-    bind_matrix = bone.matrix.copy() 
-    #bind_matrix = bind_matrix * mathutils.Matrix.Rotation(math.radians(90), 4, 'Z')
-    inverse_bind_matrix = bind_matrix.inverted()
-    write_indented("%f %f %f %f" % (inverse_bind_matrix[0][0], inverse_bind_matrix[0][1], inverse_bind_matrix[0][2], inverse_bind_matrix[0][3]))
-    write_indented("%f %f %f %f" % (inverse_bind_matrix[1][0], inverse_bind_matrix[1][1], inverse_bind_matrix[1][2], inverse_bind_matrix[1][3]))
-    write_indented("%f %f %f %f" % (inverse_bind_matrix[2][0], inverse_bind_matrix[2][1], inverse_bind_matrix[2][2], inverse_bind_matrix[2][3]))
-    write_indented("%f %f %f %f" % (inverse_bind_matrix[3][0], inverse_bind_matrix[3][1], inverse_bind_matrix[3][2], inverse_bind_matrix[3][3]))
+    write_matrix_rows(bone.inverse_bind_matrix)
     close_class() 
 
 
@@ -486,13 +2427,13 @@ def write_bone(bone, armature_matrix):
 
     write_indented("num_children %d" % (len(bone.children) + len(mesh_children)))
     for child in bone.children:
-        write_bone(child, armature_matrix)
+        write_bone(child)
 
 
     for child in mesh_children:
 
         open_class("MatrixTransform")
-        m = inverse_bind_matrix * child.matrix_local.copy()
+        m = bone.inverse_bind_matrix * child.matrix_local.copy()
 
         write_matrix(m)
         write_mesh(child, True, False)
@@ -503,10 +2444,7 @@ def write_bone(bone, armature_matrix):
 
 def write_matrix(m):
     open_class("Matrix")
-    write_indented("%f %f %f %f" % (m[0][0], m[0][1], m[0][2], m[0][3]))
-    write_indented("%f %f %f %f" % (m[1][0], m[1][1], m[1][2], m[1][3]))
-    write_indented("%f %f %f %f" % (m[2][0], m[2][1], m[2][2], m[2][3]))
-    write_indented("%f %f %f %f" % (m[3][0], m[3][1], m[3][2], m[3][3]))
+    write_matrix_rows(m)
     
     close_class()
     write_indented("num_children 1")
@@ -516,39 +2454,25 @@ def write_matrix(m):
 def write_armature(obj):
     original_pose_position = obj.data.pose_position
     obj.data.pose_position = 'REST'
-    armature = obj.data
+    skeleton = extract_skeleton(obj)
     open_class("osgAnimation::Skeleton")
-    write_indented("name \"%s\"" % (armature.name))
+    write_indented("name \"%s\"" % (skeleton.name))
     open_class("UpdateCallbacks")
     open_class("osgAnimation::UpdateSkeleton")
     close_class()
     close_class()
 
     open_class("Matrix")
-    skeleton_matrix = obj.matrix_world.copy()
-    write_indented("%f %f %f %f" % (skeleton_matrix[0][0], skeleton_matrix[0][1], skeleton_matrix[0][2], skeleton_matrix[0][3]))
-    write_indented("%f %f %f %f" % (skeleton_matrix[1][0], skeleton_matrix[1][1], skeleton_matrix[1][2], skeleton_matrix[1][3]))
-    write_indented("%f %f %f %f" % (skeleton_matrix[2][0], skeleton_matrix[2][1], skeleton_matrix[2][2], skeleton_matrix[2][3]))
-    write_indented("%f %f %f %f" % (skeleton_matrix[3][0], skeleton_matrix[3][1], skeleton_matrix[3][2], skeleton_matrix[3][3]))
+    write_matrix_rows(skeleton.matrix)
     
     close_class()
 
-    root_bones = []
-    # bones
-    for bone in obj.pose.bones:
-        m = mathutils.Matrix()
-        m.identity()
-        bone.matrix = m
-        # only add the root bones
-        if bone.parent == None:
-            root_bones.append(bone)
-
     # meshes
     mesh_children = find_armature_child_meshes(obj)
 
-    write_indented("num_children %d" % (len(root_bones) + len(mesh_children)))
-    for bone in root_bones:
-        write_bone(bone, skeleton_matrix)
+    write_indented("num_children %d" % (len(skeleton.bones) + len(mesh_children)))
+    for bone in skeleton.bones:
+        write_bone(bone)
 
     for mesh in mesh_children:
         open_class("MatrixTransform")
@@ -608,287 +2532,602 @@ def write_object(o):
     elif o.type == "CAMERA":
         print("Warning: Camera is not supported by openscenegraph exporter. Skipping.\n")
     elif o.type == "LAMP":
+        light = extract_lamp(o)
         open_class("MatrixTransform")
         write_delta_matrix(o)
-        write_lamp(o)
+        if light != None:
+            write_lamp(light)
         close_class()
 
-def get_pose_bone_by_name(name):
+def index_pose_bones():
+    # bone name -> pose bone of the first armature that has it, built once per export
+    global pose_bones_by_name
+    pose_bones_by_name = {}
     for o in bpy.data.objects:
         if o.pose:
             for pose_bone in o.pose.bones:
-                if pose_bone.bone.name == name:
-                    return pose_bone
-                for child in pose_bone.children_recursive:
-                    if child.bone.name == name:
-                        return child
-    return None
+                pose_bones_by_name.setdefault(pose_bone.bone.name, pose_bone)
+
+def get_pose_bone_by_name(name):
+    return pose_bones_by_name.get(name)
+
+bone_path_pattern = re.compile(r"bones\[\"([^\"]*)\"\]")
+property_path_pattern = re.compile(r"\.([^.]*)$")
+
+# data path -> (bone name, property name), the same paths come back for every action
+parsed_paths = {}
+
+def parse_path(path):
+    parsed = parsed_paths.get(path)
+    if parsed is None:
+        bone = bone_path_pattern.search(path)
+        if bone == None:
+            print("Could not get bone from path: %s" % path);
+        prop = property_path_pattern.search(path)
+        if prop == None:
+            print("Could not get property from path: %s" % path);
+        parsed = (bone and bone.group(1), prop and prop.group(1))
+        parsed_paths[path] = parsed
+    return parsed
 
 def get_bone_from_path(path):
-    result = re.search("bones\[\"([^\"]*)\"\]", path)
-    if result != None:
-        return result.group(1)
-    print("Could not get bone from path: %s" % path);
-    return None
+    return parse_path(path)[0]
 
 def get_property_from_path(path):
-    result = re.search("\.([^.]*)$", path)
-    if result != None:
-        return result.group(1)
-    print("Could not get property from path: %s" % path);
-    return None
+    return parse_path(path)[1]
 
-def get_action_fcurve(action, path, array_index):
+def index_action_fcurves(action):
+    # (data_path, array_index) -> fcurve of one action
+    fcurves = {}
     for fcurve in action.fcurves:
-        if fcurve.data_path == path and fcurve.array_index == array_index:
-            return fcurve
-    return None
+        fcurves.setdefault((fcurve.data_path, fcurve.array_index), fcurve)
+    return fcurves
+
+def get_action_fcurve(fcurves, path, array_index):
+    return fcurves.get((path, array_index))
+
+def interpolate_linear(a, b, time):
+    # values of the (time, values...) keys a and b interpolated at time
+    f = (time - a[0]) / (b[0] - a[0])
+    return [u + (v - u) * f for u, v in zip(a[1:], b[1:])]
+
+def interpolate_slerp(a, b, time):
+    # spherical interpolation of (time, x, y, z, w) keys along the shorter arc, as osg does
+    f = (time - a[0]) / (b[0] - a[0])
+    q1 = a[1:]
+    q2 = b[1:]
+    cosine = sum([u * v for u, v in zip(q1, q2)])
+    if cosine < 0.0:
+        cosine = -cosine
+        q2 = [-v for v in q2]
+    if cosine > 0.9999:
+        scale1 = 1.0 - f
+        scale2 = f
+    else:
+        omega = math.acos(cosine)
+        sine = math.sin(omega)
+        scale1 = math.sin((1.0 - f) * omega) / sine
+        scale2 = math.sin(f * omega) / sine
+    return [scale1 * u + scale2 * v for u, v in zip(q1, q2)]
+
+def translation_error(values, key):
+    return math.sqrt(sum([(u - v) * (u - v) for u, v in zip(values, key[1:])]))
+
+def scale_error(values, key):
+    error = 0.0
+    for u, v in zip(values, key[1:]):
+        if v != 0.0:
+            error = max(error, abs(u / v - 1.0))
+        else:
+            error = max(error, abs(u))
+    return error
+
+def rotation_error(values, key):
+    # angle between the interpolated and the actual rotation
+    length = math.sqrt(sum([u * u for u in values]) * sum([v * v for v in key[1:]])) or 1.0
+    cosine = abs(sum([u * v for u, v in zip(values, key[1:])])) / length
+    return 2.0 * math.acos(min(cosine, 1.0))
+
+def reduce_keys(keys, interpolate, error, tolerance):
+    # Keeps the first and last key and splits the range at the key that the
+    # interpolation between the kept keys misses the most, until every dropped
+    # key is reproduced within tolerance.
+    if len(keys) < 3:
+        return keys
+
+    keep = [False] * len(keys)
+    keep[0] = keep[-1] = True
+    segments = [(0, len(keys) - 1)]
+    while segments:
+        first, last = segments.pop()
+        worst = None
+        worst_error = tolerance
+        for index in range(first + 1, last):
+            key_error = error(interpolate(keys[first], keys[last], keys[index][0]), keys[index])
+            if key_error > worst_error:
+                worst = index
+                worst_error = key_error
+        if worst != None:
+            keep[worst] = True
+            segments.append((first, worst))
+            segments.append((worst, last))
+
+    return [key for key, kept in zip(keys, keep) if kept]
+
+class ChannelData(object):
+    '''The keys of one animated bone property, flat with width values (the time first) per key'''
+    __slots__ = ("channel_class", "name", "target", "key_format", "width", "keys", "reduction")
+
+    def key_rows(self):
+        keys = self.keys
+        width = self.width
+        return [tuple(keys[i:i + width]) for i in range(0, len(keys), width)]
+
+class AnimationData(object):
+    '''The channels of one action as they are written'''
+    __slots__ = ("name", "num_channels", "channels")
+
+def new_channel(channel_class, name, target, key_format, keys, reduction):
+    channel = ChannelData()
+    channel.channel_class = channel_class
+    channel.name = name
+    channel.target = target
+    channel.key_format = key_format
+    channel.width = key_format.count("%")
+    channel.keys = array.array('d', [value for key in keys for value in key])
+    # (interpolate, error, tolerance) for reduce_keys
+    channel.reduction = reduction
+    return channel
+
+def write_keyframes(channel):
+    global action_key_counts
+    keys = channel.key_rows()
+    action_key_counts[0] += len(keys)
+    if reduce_keyframes:
+        interpolate, error, tolerance = channel.reduction
+        keys = reduce_keys(keys, interpolate, error, tolerance)
+    action_key_counts[1] += len(keys)
+
+    open_class(channel.channel_class)
+    write_indented("name \"%s\"" % channel.name)
+    write_indented("target \"%s\"" % channel.target)
+    open_class("Keyframes %d" % (len(keys)))
+    write_rows(channel.key_format, keys)
+    close_class()
+    close_class()
+
+def get_channel_size(bone_name, bone_property):
+    # number of components of an exported bone channel, 0 if it is not exported
+    if bone_property.lower() in ('scale', 'location'):
+        return 3
+    pose_bone = get_pose_bone_by_name(bone_name)
+    if bone_property.lower() == 'rotation_euler':
+        if pose_bone != None and 'Z' in pose_bone.rotation_mode:
+            return 3
+    elif bone_property.lower() == 'rotation_quaternion':
+        if pose_bone != None and pose_bone.rotation_mode == 'QUATERNION':
+            return 4
+    return 0
+
+def collect_channel_keyframes(action):
+    # restructure fcurves into channels (a channel combines x, y, and z for translation for example)
+    channels = {}
+    for fcurve in action.fcurves:
+        if fcurve.data_path not in channels:
+            channels[fcurve.data_path] = {}
+
+        for keyframe in fcurve.keyframe_points:
+            if keyframe.co[0] not in channels[fcurve.data_path]:
+                channels[fcurve.data_path][keyframe.co[0]] = {}
+            channels[fcurve.data_path][keyframe.co[0]][fcurve.array_index] = keyframe.co[1]
+
+    return channels
+
+def get_bake_frames(action):
+    # frames sampled between the start and end of the action at the bake rate
+    start, end = action.frame_range
+    step = 1.0
+    if bake_rate > 0:
+        step = current_scene.render.fps / float(bake_rate)
+    count = int(math.floor((end - start) / step + 1e-6)) + 1
+    frames = [start + i * step for i in range(count)]
+    if frames[-1] < end:
+        frames.append(end)
+    return frames
+
+def sample_fcurve(fcurve, frames):
+    evaluate = fcurve.evaluate
+    return [evaluate(frame) for frame in frames]
+
+def bake_channels(action, fcurves):
+    # Samples every exported bone channel of the action at fixed frames. Components
+    # without an fcurve keep their rest value instead of dropping the channel.
+    frames = get_bake_frames(action)
+    channels = {}
+    for fcurve in action.fcurves:
+        path = fcurve.data_path
+        if path in channels:
+            continue
+        bone_name = get_bone_from_path(path)
+        bone_property = get_property_from_path(path)
+        if bone_name == None or bone_property == None:
+            continue
+        num_properties = get_channel_size(bone_name, bone_property)
+        if num_properties == 0:
+            continue
+
+        rest_values = CHANNEL_REST_VALUES[bone_property.lower()]
+        components = []
+        for i in range(0, num_properties):
+            component = get_action_fcurve(fcurves, path, i)
+            if component != None:
+                components.append(sample_fcurve(component, frames))
+            else:
+                components.append([rest_values[i]] * len(frames))
+        channels[path] = dict((frame, dict(enumerate(values))) for frame, values in zip(frames, zip(*components)))
+
+    return channels
+
+def euler_to_quaternions(order, eulers):
+    # converts (x, y, z) euler rows with the given rotation order to (x, y, z, w) quaternion rows
+    if numpy is None or not eulers:
+        quats = []
+        for x, y, z in eulers:
+            euler = mathutils.Euler()
+            euler.order = order
+            euler.x = x
+            euler.y = y
+            euler.z = z
+            quat = euler.to_quaternion()
+            quats.append((quat.x, quat.y, quat.z, quat.w))
+        return quats
+
+    half_angles = numpy.array(eulers, dtype=numpy.float64) * 0.5
+    cosines = numpy.cos(half_angles)
+    sines = numpy.sin(half_angles)
+    w = numpy.ones(len(eulers))
+    v = numpy.zeros((len(eulers), 3))
+    # the first axis of the order is applied first: q = q_axis * q for each axis
+    for axis in order:
+        a = "XYZ".index(axis)
+        c = cosines[:, a]
+        s = sines[:, a]
+        unit = numpy.zeros(3)
+        unit[a] = 1.0
+        new_w = c * w - s * v[:, a]
+        v = c[:, None] * v + numpy.cross(unit, v) * s[:, None]
+        v[:, a] += s * w
+        w = new_w
+    return [tuple(q) for q in numpy.column_stack((v, w)).tolist()]
+
+def extract_animation(action):
+    # the channels of action with their keys, holes filled and axes converted
+    animation = AnimationData()
+    animation.name = action.name
+    animation.channels = []
+
+    fcurves = index_action_fcurves(action)
+    if bake_animation:
+        channels = bake_channels(action, fcurves)
+    else:
+        channels = collect_channel_keyframes(action)
+
+    # fix any "holes" ie in blender we can animate on the x channel only - in this case we should either drop the animation or evaluate the curve at the hole
+    for path in iter(channels):
+        channel = channels[path]
+        bone_name = get_bone_from_path(path)
+        bone_property = get_property_from_path(path)
+        channel_skipped = False
+
+        if bone_name != None and bone_property != None:
+            num_properties = get_channel_size(bone_name, bone_property)
+            if num_properties > 0:
+                for keyframe in channels[path].keys():
+                    for i in range(0, num_properties):
+                        if not i in channels[path][keyframe]:
+                            fcurve = get_action_fcurve(fcurves, path, i)
+                            if fcurve != None:
+                                channels[path][keyframe][i] = fcurve.evaluate(keyframe)
+                            else:
+                                # no fcurve exists for this property
+                                # we will have to skip the entire action
+                                channels.remove(path)
+                                channel_skipped = True
+                    if channel_skipped:
+                        break
+                if channel_skipped:
+                    break
+
+
+    animation.num_channels = len(channels)
+    
+    for path in iter(channels):
+        channel = channels[path]
+        bone_name = get_bone_from_path(path)
+        bone_property = get_property_from_path(path)
+
+        if bone_name != None and bone_property != None:
+            if bone_property.lower() == 'scale':
+                keys = []
+                for timestamp in sorted(channel.keys()):
+                    #keys.append((timestamp/current_scene.render.fps, channel[timestamp][1], channel[timestamp][0], channel[timestamp][2]))
+                    keys.append((timestamp/current_scene.render.fps, channel[timestamp][0], channel[timestamp][2], channel[timestamp][1]))
+                animation.channels.append(new_channel("Vec3LinearChannel", "scale", bone_name, "key %f %f %f %f", keys, (interpolate_linear, scale_error, scale_tolerance)))
+            elif bone_property.lower() == 'location':
+                keys = []
+                for timestamp in sorted(channel.keys()):
+                    # note the axis translation
+                    #keys.append((timestamp/current_scene.render.fps, channel[timestamp][1], -channel[timestamp][0], channel[timestamp][2]))
+                    #keys.append((timestamp/current_scene.render.fps, channel[timestamp][1], channel[timestamp][0], channel[timestamp][2]))
+                    #keys.append((timestamp/current_scene.render.fps, channel[timestamp][0], channel[timestamp][1], channel[timestamp][2]))
+                    keys.append((timestamp/current_scene.render.fps, channel[timestamp][0], channel[timestamp][2], -channel[timestamp][1]))
+                animation.channels.append(new_channel("Vec3LinearChannel", "translate", bone_name, "key %f %f %f %f", keys, (interpolate_linear, translation_error, translation_tolerance)))
+            elif bone_property.lower() == 'rotation_euler':
+                # first - tweak the axis
+                # then convert to quaternion
+                pose_bone = get_pose_bone_by_name(bone_name)
+                if pose_bone != None and 'Z' in pose_bone.rotation_mode:
+                    timestamps = sorted(channel.keys())
+                    quats = euler_to_quaternions(pose_bone.rotation_mode, [(channel[timestamp][0], channel[timestamp][1], channel[timestamp][2]) for timestamp in timestamps])
+                    keys = [(timestamp/current_scene.render.fps,) + quat for timestamp, quat in zip(timestamps, quats)]
+
+                    animation.channels.append(new_channel("QuatSphericalLinearChannel", "quaternion", bone_name, "key %f %f %f %f %f", keys, (interpolate_slerp, rotation_error, math.radians(rotation_tolerance))))
+            elif bone_property.lower() == 'rotation_quaternion':
+                pose_bone = get_pose_bone_by_name(bone_name)
+                if pose_bone != None and pose_bone.rotation_mode == 'QUATERNION':
+                    keys = []
+                    for timestamp in sorted(channel.keys()):
+                        quat = mathutils.Quaternion()
+                        quat.w = channel[timestamp][0]
+                        quat.x = channel[timestamp][1]
+                        quat.y = channel[timestamp][2]
+                        quat.z = channel[timestamp][3]
+
+                        # convert to euler fix the axis and then back to quat
+                        #euler = quat.to_euler('XYZ')
+                        #t = euler.x
+                        #euler.x = euler.y
+                        #euler.y = -t
+                        #quat = euler.to_quaternion()
+
+                        # quat.rotate(mathutils.Matrix.Rotation(math.radians(-90), 4, 'Y'))
+
+                        keys.append((timestamp/current_scene.render.fps, quat.x, quat.y, quat.z, quat.w))
+
+                    animation.channels.append(new_channel("QuatSphericalLinearChannel", "quaternion", bone_name, "key %f %f %f %f %f", keys, (interpolate_slerp, rotation_error, math.radians(rotation_tolerance))))
+            # end if bone_name and bone_property
+        # end for path in channels
+
+    return animation
 
 def write_actions(actions):
-    global current_scene
+    global current_scene, action_key_counts
     open_class("UpdateCallbacks")
     open_class("osgAnimation::BasicAnimationManager")
     write_indented("num_animations %d" % (len(actions)))
     for action in actions:
+        start = time.time()
+        animation = extract_animation(action)
         open_class("osgAnimation::Animation")
-        write_indented("name \"%s\"" % (action.name))
-
-        # restructure fcurves into channels (a channel combines x, y, and z for translation for example)
-        channels = {}
-        for fcurve in action.fcurves:
-            if fcurve.data_path not in channels:
-                channels[fcurve.data_path] = {}
-
-            for keyframe in fcurve.keyframe_points:
-                if keyframe.co[0] not in channels[fcurve.data_path]:
-                    channels[fcurve.data_path][keyframe.co[0]] = {}
-                channels[fcurve.data_path][keyframe.co[0]][fcurve.array_index] = keyframe.co[1]
-
-        # fix any "holes" ie in blender we can animate on the x channel only - in this case we should either drop the animation or evaluate the curve at the hole
-        for path in iter(channels):
-            channel = channels[path]
-            bone_name = get_bone_from_path(path)
-            bone_property = get_property_from_path(path)
-            channel_skipped = False
-
-            if bone_name != None and bone_property != None:
-                num_properties = 0
-                if bone_property.lower() == 'scale':
-                    num_properties = 3
-                elif bone_property.lower() == 'location':
-                    num_properties = 3
-                elif bone_property.lower() == 'rotation_euler':
-                    pose_bone = get_pose_bone_by_name(bone_name)
-                    if pose_bone != None and 'Z' in pose_bone.rotation_mode:
-                        num_properties = 3
-                elif bone_property.lower() == 'rotation_quaternion':
-                    pose_bone = get_pose_bone_by_name(bone_name)
-                    if pose_bone != None and pose_bone.rotation_mode == 'QUATERNION':
-                        num_properties = 4
-                if num_properties > 0:
-                    for keyframe in channels[path].keys():
-                        for i in range(0, num_properties):
-                            if not i in channels[path][keyframe]:
-                                fcurve = get_action_fcurve(action, path, i)
-                                if fcurve != None:
-                                    channels[path][keyframe][i] = fcurve.evaluate(keyframe)
-                                else:
-                                    # no fcurve exists for this property
-                                    # we will have to skip the entire action
-                                    channels.remove(path)
-                                    channel_skipped = True
-                        if channel_skipped:
-                            break
-                    if channel_skipped:
-                        break
-
-
-        write_indented("num_channels %d" % (len(channels)))
-        
-        for path in iter(channels):
-            channel = channels[path]
-            bone_name = get_bone_from_path(path)
-            bone_property = get_property_from_path(path)
-
-            if bone_name != None and bone_property != None:
-                if bone_property.lower() == 'scale':
-                    open_class("Vec3LinearChannel")
-                    write_indented("name \"scale\"")
-                    write_indented("target \"%s\"" % (bone_name))
-                    open_class("Keyframes %d" % (len(channel)))
-
-                    for timestamp in sorted(channel.keys()):
-                        #write_indented("key %f %f %f %f" % (timestamp/current_scene.render.fps, channel[timestamp][1], channel[timestamp][0], channel[timestamp][2]))
-                        write_indented("key %f %f %f %f" % (timestamp/current_scene.render.fps, channel[timestamp][0], channel[timestamp][2], channel[timestamp][1]))
-
-                    close_class()
-                    close_class()
-                elif bone_property.lower() == 'location':
-                    open_class("Vec3LinearChannel")
-                    write_indented("name \"translate\"")
-                    write_indented("target \"%s\"" % (bone_name))
-                    open_class("Keyframes %d" % (len(channel)))
-                    for timestamp in sorted(channel.keys()):
-                        # note the axis translation
-                        #write_indented("key %f %f %f %f" % (timestamp/current_scene.render.fps, channel[timestamp][1], -channel[timestamp][0], channel[timestamp][2]))
-                        #write_indented("key %f %f %f %f" % (timestamp/current_scene.render.fps, channel[timestamp][1], channel[timestamp][0], channel[timestamp][2]))
-                        #write_indented("key %f %f %f %f" % (timestamp/current_scene.render.fps, channel[timestamp][0], channel[timestamp][1], channel[timestamp][2]))
-                        write_indented("key %f %f %f %f" % (timestamp/current_scene.render.fps, channel[timestamp][0], channel[timestamp][2], -channel[timestamp][1]))
-
-                    close_class()
-                    close_class()
-                elif bone_property.lower() == 'rotation_euler':
-                    # first - tweak the axis
-                    # then convert to quaternion
-                    pose_bone = get_pose_bone_by_name(bone_name)
-                    if pose_bone != None and 'Z' in pose_bone.rotation_mode:
-                        open_class("QuatSphericalLinearChannel")
-                        write_indented("name \"quaternion\"")
-                        write_indented("target \"%s\"" % (bone_name))
-                        open_class("Keyframes %d" % (len(channel)))
-                        for timestamp in sorted(channel.keys()):
-                            euler = mathutils.Euler()
-                            euler.order = pose_bone.rotation_mode
-                            euler.x = channel[timestamp][0]
-                            euler.y = channel[timestamp][1]
-                            euler.z = channel[timestamp][2]
-
-                            # reorder euler
-                         #   t = euler.x
-                          #  euler.x = euler.y
-                           # euler.y = -t
-
-                            quat = euler.to_quaternion()
-
-                            # quat.rotate(mathutils.Matrix.Rotation(math.radians(180), 4, 'Z'))
-                            # quat.
-                            write_indented("key %f %f %f %f %f" % (timestamp/current_scene.render.fps, quat.x, quat.y, quat.z, quat.w))
-
-                        close_class()
-                        close_class()
-                elif bone_property.lower() == 'rotation_quaternion':
-                    pose_bone = get_pose_bone_by_name(bone_name)
-                    if pose_bone != None and pose_bone.rotation_mode == 'QUATERNION':
-                        open_class("QuatSphericalLinearChannel")
-                        write_indented("name \"quaternion\"")
-                        write_indented("target \"%s\"" % (bone_name))
-                        open_class("Keyframes %d" % (len(channel)))
-                        for timestamp in sorted(channel.keys()):
-                            quat = mathutils.Quaternion()
-                            quat.w = channel[timestamp][0]
-                            quat.x = channel[timestamp][1]
-                            quat.y = channel[timestamp][2]
-                            quat.z = channel[timestamp][3]
-
-                            # convert to euler fix the axis and then back to quat
-                            #euler = quat.to_euler('XYZ')
-                            #t = euler.x
-                            #euler.x = euler.y
-                            #euler.y = -t
-                            #quat = euler.to_quaternion()
-
-                            # quat.rotate(mathutils.Matrix.Rotation(math.radians(-90), 4, 'Y'))
-
-                            write_indented("key %f %f %f %f %f" % (timestamp/current_scene.render.fps, quat.x, quat.y, quat.z, quat.w))
-
-                        close_class()
-                        close_class()
-                # end if bone_name and bone_property
-            # end for path in channels
+        write_indented("name \"%s\"" % (animation.name))
+        action_key_counts = [0, 0]
+        write_indented("num_channels %d" % (animation.num_channels))
+        for channel in animation.channels:
+            write_keyframes(channel)
+        if reduce_keyframes:
+            print("%s: %d keys, %d after reduction" % (action.name, action_key_counts[0], action_key_counts[1]))
         close_class()
+        add_time("animation", start, action.name, "actions")
+        add_count("keys", action_key_counts[1], action.name, "actions")
 
     close_class()
     close_class()
 
+def find_scene_actions(s):
+    # actions with a channel on a bone of an armature exported from this scene,
+    # limited to the action whitelist when one is given
+    bone_names = set()
+    for obj_base in s.object_bases:
+        o = obj_base.object
+        if (not only_selected or obj_base.select) and o.type == 'ARMATURE' and o.pose:
+            for pose_bone in o.pose.bones:
+                bone_names.add(pose_bone.bone.name)
+
+    actions = []
+    for action in bpy.data.actions:
+        if export_actions != None and action.name not in export_actions:
+            continue
+        for fcurve in action.fcurves:
+            if get_bone_from_path(fcurve.data_path) in bone_names:
+                actions.append(action)
+                break
+
+    return actions
+
 def write_scene(s):
     global only_selected, current_scene, export_animations, orphan_meshes
 
-    orphan_meshes = []
     current_scene = s
+    index_scene_meshes(s)
 
     open_class("Group")
     write_indented("name \"%s\"" % s.name)
     open_class("MatrixTransform")
     m = mathutils.Matrix.Rotation(math.radians(90), 4, 'X')
     open_class("Matrix")
-    write_indented("%f %f %f %f" % (m[0][0], m[0][1], m[0][2], m[0][3]))
-    write_indented("%f %f %f %f" % (m[1][0], m[1][1], m[1][2], m[1][3]))
-    write_indented("%f %f %f %f" % (m[2][0], m[2][1], m[2][2], m[2][3]))
-    write_indented("%f %f %f %f" % (m[3][0], m[3][1], m[3][2], m[3][3]))
+    write_matrix_rows(m)
     
     close_class()
 
-    num_objects = 0
+    actions = []
     if export_animations:
+        actions = find_scene_actions(s)
+
+    num_objects = 0
+    if actions:
         num_objects += 1
 
     for obj_base in s.object_bases:
         if (not only_selected or obj_base.select) and obj_base.object.type in ['MESH', 'LAMP']:
             num_objects += 1
 
-    for m in s.objects:
-        if m.type == 'MESH':
-            orphan_meshes.append(m)
+    orphan_meshes = set(m for m in s.objects if m.type == 'MESH')
 
     
     write_indented("num_children %d" % num_objects)
-    if export_animations:
-        write_actions(bpy.data.actions)
+    if actions:
+        write_actions(actions)
 
     for obj_base in s.object_bases:
         if not only_selected or obj_base.select: 
             write_object(obj_base.object)
 
-    for orphan_mesh in orphan_meshes:
+    # write_mesh takes each mesh out of the set, so walk the scene order instead
+    for orphan_mesh in [m for m in s.objects if m in orphan_meshes]:
         open_class("MatrixTransform")
         write_delta_matrix(orphan_mesh)
         write_mesh(orphan_mesh, False, False)
         close_class()
 
+    if shared_instances > 0:
+        print("%s: %d objects share the geometry of an earlier object" % (s.name, shared_instances))
+
     close_class()
 
     close_class()
 
-def write_osg(context, option_filepath, option_export_animations, option_only_selected, option_apply_modifiers):
-    global indent_level, filepath, export_file, export_animations, only_selected, apply_modifiers
-    indent_level = 0
+def write_osg(context, option_filepath, option_export_animations, option_only_selected, option_apply_modifiers, option_weld_vertices=True, option_weld_epsilon=0.0001, option_index_mode='AUTO', option_optimize_vertex_cache=False, option_triangle_strips=False, option_format='OSG', option_compression='NONE', option_reduce_keyframes=False, option_translation_tolerance=0.001, option_scale_tolerance=0.001, option_rotation_tolerance=0.05, option_bake_animation=False, option_bake_rate=0.0, option_actions=None, option_texture_max_size=0, option_texture_power_of_two=False, option_texture_workers=0, option_incremental=False, option_serialize_workers=0, option_profile=None, option_streaming=False):
+    global emitter, filepath, export_animations, only_selected, apply_modifiers, weld_vertices, weld_epsilon, index_mode, optimize_vertex_cache, triangle_strips, reduce_keyframes, translation_tolerance, scale_tolerance, rotation_tolerance, bake_animation, bake_rate, export_actions, texture_max_size, texture_power_of_two, texture_workers, incremental, streaming, extracted_materials, unique_id_count
+    unique_id_count = 0
+    start_profile()
     only_selected = option_only_selected
     export_animations = option_export_animations
     apply_modifiers = option_apply_modifiers
+    weld_vertices = option_weld_vertices
+    weld_epsilon = option_weld_epsilon
+    index_mode = option_index_mode
+    optimize_vertex_cache = option_optimize_vertex_cache
+    triangle_strips = option_triangle_strips
+    reduce_keyframes = option_reduce_keyframes
+    translation_tolerance = option_translation_tolerance
+    scale_tolerance = option_scale_tolerance
+    rotation_tolerance = option_rotation_tolerance
+    bake_animation = option_bake_animation
+    bake_rate = option_bake_rate
+    # names of the actions to export, None for every action used by the exported armatures
+    export_actions = option_actions
+    texture_max_size = option_texture_max_size
+    texture_power_of_two = option_texture_power_of_two
+    texture_workers = option_texture_workers
+    incremental = option_incremental
+    # one object in memory at a time, for scenes larger than memory
+    streaming = option_streaming
     filepath = option_filepath
+    index_pose_bones()
+    # materials read by extract_material, by slot name, material and object color
+    extracted_materials = {}
+    # the binary writer serializes its blocks after the traversal, the text is formatted in processes
+    start_serialize_pool(option_serialize_workers if option_format != 'OSGB' else 0)
+    start_texture_export()
+    if incremental:
+        start_fragment_cache()
 
     print("export model to osg... " + filepath)
-    export_file = open(filepath, 'w')
+    if option_format == 'OSGB':
+        spool = None
+        if streaming:
+            # next to the output, the temporary directory may be in memory
+            spool = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(filepath)))
+        emitter = OSGBinaryEmitter(open(filepath, 'wb'), spool=spool)
+    elif option_compression != 'NONE':
+        emitter = OSGEmitter(CompressedOutput(filepath, option_compression))
+    else:
+        emitter = OSGEmitter(open(filepath, 'w'))
 
     for s in bpy.data.scenes:
         write_scene(s)
 
-    export_file.close()
-
+    start = time.time()
+    emitter.close()
+    add_time("serialization", start)
+    if serialize_pool != None:
+        serialize_pool.shutdown()
+    add_count("bytes_written", os.path.getsize(filepath))
+    finish_texture_export()
+    if incremental:
+        finish_fragment_cache()
+    peak = peak_memory()
+    if peak != None:
+        # of the whole blender process, including the loaded scene
+        add_count("peak_rss_bytes", peak)
+        print("peak memory: %.1f MB" % (peak / 1048576.0))
+    if option_profile:
+        write_profile(option_profile)
+
+    # blender exits with 0 even when the script fails, batch drivers look for this line
+    print("export finished: " + filepath)
     return {'FINISHED'}
 
 
 # ExportHelper is a helper class, defines filename and
 # invoke() function which calls the file selector.
 from bpy_extras.io_utils import ExportHelper
-from bpy.props import StringProperty, BoolProperty, EnumProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty, FloatProperty, IntProperty
 
 
 class ExportOSG(bpy.types.Operator, ExportHelper):
-    '''Export meshes, lights and animation to OpenSceneGraph text format (.osg)'''
+    '''Export meshes, lights and animation to OpenSceneGraph text (.osg) or binary (.osgb) format'''
     bl_idname = "export.osg"  # this is important since its how bpy.ops.export.osg is constructed
     bl_label = "Export OSG"
 
     # ExportHelper mixin class uses this
     filename_ext = ".osg"
 
-    filter_glob = StringProperty(default="*.osg", options={'HIDDEN'})
+    filter_glob = StringProperty(default="*.osg;*.osgb;*.osgz", options={'HIDDEN'})
 
     # List of operator properties, the attributes will be assigned
     # to the class instance from the operator settings before calling.
     export_animations = BoolProperty(name="Include Animation", description="Create Armatures in the exported model", default=True)
     apply_modifiers = BoolProperty(name="Apply Modifiers", description="Apply modifiers to the mesh before exporting.", default=True)
     only_selected = BoolProperty(name="Only Selected", description="Only export selected objects", default=False)
+    weld_vertices = BoolProperty(name="Weld Vertices", description="Share vertices between faces with the same position, normal and uv. Disable to keep hard seams.", default=True)
+    weld_epsilon = FloatProperty(name="Weld Epsilon", description="Maximum difference for vertices to be welded together", default=0.0001, min=0.0, precision=6)
+    index_mode = EnumProperty(items=(('AUTO', "32 Bit Indices", "Use 32 bit indices for drawables with more than 65536 vertices"),
+                                     ('SPLIT', "Split Geometry", "Split meshes with more than 65536 vertices into drawables that fit 16 bit indices"),
+                                     ),
+                              name="Large Meshes",
+                              description="How to export meshes that do not fit 16 bit indices",
+                              default='AUTO')
+    optimize_vertex_cache = BoolProperty(name="Optimize Vertex Cache", description="Reorder triangles and vertices for the post-transform vertex cache", default=False)
+    triangle_strips = BoolProperty(name="Triangle Strips", description="Write triangles as strips where that needs fewer indices", default=False)
+    actions = StringProperty(name="Actions", description="Comma separated names of the actions to export. Empty exports every action used by the exported armatures", default="")
+    bake_animation = BoolProperty(name="Bake Animation", description="Sample every animated bone channel at a fixed rate instead of exporting the keyframes", default=False)
+    bake_rate = FloatProperty(name="Bake Rate", description="Samples per second of baked animation, 0 uses the scene frame rate", default=0.0, min=0.0)
+    reduce_keyframes = BoolProperty(name="Reduce Keyframes", description="Drop keyframes that interpolation between their neighbours reproduces within the tolerances", default=False)
+    translation_tolerance = FloatProperty(name="Translation Tolerance", description="Largest distance a dropped translation key may be off", default=0.001, min=0.0, precision=4)
+    scale_tolerance = FloatProperty(name="Scale Tolerance", description="Largest relative error of a dropped scale key", default=0.001, min=0.0, precision=4)
+    rotation_tolerance = FloatProperty(name="Rotation Tolerance", description="Largest angle in degrees a dropped rotation key may be off", default=0.05, min=0.0, precision=3)
+    texture_max_size = IntProperty(name="Max Texture Size", description="Scale down textures larger than this, 0 keeps their size", default=0, min=0)
+    texture_power_of_two = BoolProperty(name="Power of Two Textures", description="Scale textures to the nearest power of two size", default=False)
+    texture_workers = IntProperty(name="Texture Workers", description="Number of threads, or processes without NumPy, encoding textures, 0 uses one per processor", default=0, min=0)
+    profile_report = StringProperty(name="Profile Report", description="Json file the time spent in each export stage is written to, nothing is written when empty", default="")
+    serialize_workers = IntProperty(name="Serialization Processes", description="Number of processes formatting the geometry of the text format, 0 formats it in blender", default=0, min=0)
+    streaming = BoolProperty(name="Streaming", description="Free every evaluated mesh as soon as it is written and keep binary output on disk, for scenes that do not fit in memory", default=False)
+    incremental = BoolProperty(name="Incremental", description="Reuse the Geodes of unchanged objects from the previous export to the same file", default=False)
+    file_format = EnumProperty(items=(('OSG', "Text (.osg)", "Write the osg text format"),
+                                      ('OSGB', "Binary (.osgb)", "Write the native binary format read by OpenSceneGraph 3.0 and later"),
+                                      ),
+                               name="Format",
+                               description="File format of the exported model",
+                               default='OSG')
+    compression = EnumProperty(items=(('NONE', "None", "Write plain text"),
+                                      ('GZIP', "Gzip (.osgz)", "Compress the text with gzip while it is written"),
+                                      ('ZSTD', "Zstandard (.osg.zst)", "Compress the text with zstandard, needs the zstandard module"),
+                                      ('LZ4', "LZ4 (.osg.lz4)", "Compress the text with lz4, needs the lz4 module"),
+                                      ),
+                               name="Compression",
+                               description="Compression of text exports",
+                               default='NONE')
 
     # type = EnumProperty(items=(('OPT_A', "First Option", "Description one"),
     #                            ('OPT_B', "Second Option", "Description two."),
@@ -902,7 +3141,18 @@ class ExportOSG(bpy.types.Operator, ExportHelper):
         return context.active_object != None
 
     def execute(self, context):
-        return write_osg(context, self.filepath, self.export_animations, self.only_selected, self.apply_modifiers)
+        filepath = self.filepath
+        if self.file_format == 'OSGB':
+            filepath = os.path.splitext(filepath)[0] + ".osgb"
+        elif self.compression != 'NONE':
+            filepath = os.path.splitext(filepath)[0] + COMPRESSED_EXTENSIONS[self.compression]
+        return write_osg(context, filepath, self.export_animations, self.only_selected, self.apply_modifiers, self.weld_vertices, self.weld_epsilon, self.index_mode, self.optimize_vertex_cache, self.triangle_strips, self.file_format, self.compression, self.reduce_keyframes, self.translation_tolerance, self.scale_tolerance, self.rotation_tolerance, self.bake_animation, self.bake_rate, parse_action_names(self.actions), self.texture_max_size, self.texture_power_of_two, self.texture_workers, self.incremental, self.serialize_workers, self.profile_report, self.streaming)
+
+
+def parse_action_names(names):
+    # comma separated action names -> list, None when empty
+    names = [name.strip() for name in names.split(",") if name.strip()]
+    return names or None
 
 
 # Only needed if you want to add into a dynamic menu
@@ -924,11 +3174,35 @@ if __name__ == "__main__":
 
     i = sys.argv.index("--")
     filename = ''
+    actions = None
+    incremental = False
+    processes = 0
+    profile_path = None
+    streaming = False
     if i >= 0:
         filename = sys.argv[i+1]
+        for arg in sys.argv[i+2:]:
+            if arg.startswith("--actions="):
+                actions = parse_action_names(arg[len("--actions="):])
+            elif arg == "--incremental":
+                incremental = True
+            elif arg.startswith("--processes="):
+                processes = int(arg[len("--processes="):])
+            elif arg.startswith("--profile="):
+                profile_path = arg[len("--profile="):]
+            elif arg == "--streaming":
+                streaming = True
 
     if filename != '':
-        write_osg(None, filename, True, False, True)
+        # the format and compression follow the extension of the output file
+        compression = 'NONE'
+        for method, extension in COMPRESSED_EXTENSIONS.items():
+            if filename.lower().endswith(extension):
+                compression = method
+        if filename.lower().endswith(".osgb"):
+            write_osg(None, filename, True, False, True, option_format='OSGB', option_actions=actions, option_incremental=incremental, option_serialize_workers=processes, option_profile=profile_path, option_streaming=streaming)
+        else:
+            write_osg(None, filename, True, False, True, option_compression=compression, option_actions=actions, option_incremental=incremental, option_serialize_workers=processes, option_profile=profile_path, option_streaming=streaming)
     else:
         register()
 
@@ -1,20 +1,118 @@
 #!/usr/bin/python
 
+# Exports blend files with blender in the background, several at a time.
+#
+#   test.py                          every data/*.blend into test/
+#   test.py data/character.blend     a single file
+#   test.py --jobs 8 --timeout 600 --retries 1 --manifest test/manifest.csv
+#   test.py --blender /opt/blender/blender --export-args=--incremental
+#
+# Each export writes <output dir>/<name>.blend.osg and its blender output to
+# <name>.blend.log. The manifest records the duration, output size and status
+# of every file, as json or csv depending on its extension.
+
 import os
-import subprocess
-import glob
+import csv
 import sys
+import json
+import glob
+import time
+import argparse
+import subprocess
+import concurrent.futures
+
+# printed by the exporter when the model is completely written
+EXPORT_DONE = "export finished: "
+
+
+def export_file(blender, testcase, output, timeout, retries, extra_args):
+    # run one export, again up to retries times if it fails or times out
+    command = [blender, "-b", testcase, "-P", "src/io_export_osg.py", "--", output] + extra_args
+    result = {"file": testcase, "output": output, "attempts": 0}
+    start = time.time()
+    for attempt in range(retries + 1):
+        result["attempts"] = attempt + 1
+        if os.path.exists(output):
+            os.unlink(output)
+        with open(output + ".log", 'w') as log:
+            try:
+                exit_code = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                result["exit_code"] = None
+                result["status"] = "timeout"
+                continue
+        result["exit_code"] = exit_code
+        # blender exits with 0 even when the script fails and the exporter may have
+        # written part of the file, so the log has to show the export finished
+        if exit_code == 0 and os.path.exists(output) and os.path.getsize(output) > 0 and export_finished(output + ".log"):
+            result["status"] = "ok"
+            break
+        result["status"] = "failed"
+    result["duration"] = round(time.time() - start, 3)
+    result["output_size"] = os.path.getsize(output) if os.path.exists(output) else 0
+    return result
+
+
+def export_finished(log_path):
+    with open(log_path, errors="replace") as log:
+        text = log.read()
+    return EXPORT_DONE in text and "Traceback (most recent call last)" not in text
+
+
+def write_manifest(path, results):
+    fields = ["file", "output", "status", "exit_code", "attempts", "duration", "output_size"]
+    with open(path, 'w') as manifest:
+        if path.lower().endswith(".csv"):
+            writer = csv.DictWriter(manifest, fields)
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump(results, manifest, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export blend files to osg with blender.")
+    parser.add_argument("testcases", nargs="*", help="blend files to export, data/*.blend by default")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"), help="blender executable")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of exports running at once")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds before an export is stopped")
+    parser.add_argument("--retries", type=int, default=0, help="how often a failed export is tried again")
+    parser.add_argument("--output-dir", default="test", help="directory the exports are written to")
+    parser.add_argument("--extension", default=".osg", help="extension of the exported files, .osgb or .osgz change the format")
+    parser.add_argument("--manifest", default=None, help="json or csv file recording the result of every export")
+    parser.add_argument("--export-args", default="", help="arguments passed on to the exporter, like --incremental")
+    args = parser.parse_args()
+
+    testcases = args.testcases or sorted(glob.glob('data/*.blend'))
+    outputs = [os.path.join(args.output_dir, os.path.basename(testcase) + args.extension) for testcase in testcases]
+
+    # only the files this run writes, the output directory may hold anything else
+    print("Delete old test files\n")
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    for output in outputs:
+        for oldtestfile in (output, output + ".log"):
+            if os.path.isfile(oldtestfile):
+                os.unlink(oldtestfile)
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max(args.jobs, 1)) as pool:
+        jobs = [pool.submit(export_file, args.blender, testcase, output, args.timeout, args.retries, args.export_args.split())
+                for testcase, output in zip(testcases, outputs)]
+        results = []
+        for job in jobs:
+            result = job.result()
+            print("%-8s %8.2fs %10d bytes  %s" % (result["status"], result["duration"], result["output_size"], result["file"]))
+            results.append(result)
 
+    failed = [result for result in results if result["status"] != "ok"]
+    print("\n%d exported, %d failed in %.2f seconds" % (len(results) - len(failed), len(failed), time.time() - start))
 
-print("Delete old test files\n")
-for oldtestfile in glob.glob('test/*'):
-    os.unlink(oldtestfile)
+    if args.manifest:
+        write_manifest(args.manifest, results)
 
+    return 1 if failed else 0
 
-if len(sys.argv) > 1:
-    testcase = sys.argv[1]
-    subprocess.call(["blender", "-b", testcase, "-P", "src/io_export_osg.py", "--", "test/" + os.path.basename(testcase) + ".osg"])
-else:
-    for testcase in glob.glob('data/*.blend'):
-        subprocess.call(["blender", "-b", testcase, "-P", "src/io_export_osg.py", "--", "test/" + os.path.basename(testcase) + ".osg"])
 
+if __name__ == "__main__":
+    sys.exit(main())
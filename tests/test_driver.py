@@ -0,0 +1,106 @@
+# Tests of the batch export driver test.py, with a stand-in for blender.
+#
+# The stub writes the output the way the name of the blend file says: ok*.blend
+# exports completely, crash*.blend writes part of the file, prints a traceback and
+# still exits with 0 like blender does when the script fails.
+
+import os
+import sys
+import json
+import stat
+import subprocess
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DRIVER_PATH = os.path.join(ROOT, "test.py")
+
+STUB_BLENDER = '''#!%s
+import os
+import sys
+testcase = sys.argv[2]
+output = sys.argv[sys.argv.index("--") + 1]
+with open(output, "w") as output_file:
+    output_file.write("Group {\\n")
+    if os.path.basename(testcase).startswith("crash"):
+        print("Traceback (most recent call last):")
+        print("RuntimeError: the export failed")
+        sys.exit(0)
+    output_file.write("}\\n")
+print("export finished: " + output)
+'''
+
+
+def load_driver():
+    # test.py can not be imported by name, the standard library has a test package
+    spec = importlib.util.spec_from_file_location("export_driver", DRIVER_PATH)
+    driver = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(driver)
+    return driver
+
+
+def make_blender(directory):
+    path = os.path.join(str(directory), "blender")
+    with open(path, 'w') as stub:
+        stub.write(STUB_BLENDER % sys.executable)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def make_testcases(directory, names):
+    paths = []
+    for name in names:
+        path = os.path.join(str(directory), name)
+        open(path, 'w').close()
+        paths.append(path)
+    return paths
+
+
+def test_finished_export_is_ok(tmp_path):
+    driver = load_driver()
+    testcase, = make_testcases(tmp_path, ["ok.blend"])
+    output = str(tmp_path / "ok.blend.osg")
+    result = driver.export_file(make_blender(tmp_path), testcase, output, 60, 0, [])
+    assert result["status"] == "ok"
+    assert result["exit_code"] == 0
+    assert result["output_size"] > 0
+
+
+def test_script_error_fails_despite_exit_code_zero(tmp_path):
+    driver = load_driver()
+    testcase, = make_testcases(tmp_path, ["crash.blend"])
+    output = str(tmp_path / "crash.blend.osg")
+    result = driver.export_file(make_blender(tmp_path), testcase, output, 60, 1, [])
+    assert result["exit_code"] == 0
+    assert result["output_size"] > 0
+    assert result["status"] == "failed"
+    assert result["attempts"] == 2
+    with open(output + ".log") as log:
+        assert "Traceback" in log.read()
+
+
+def test_manifest_and_exit_code(tmp_path):
+    testcases = make_testcases(tmp_path, ["ok.blend", "crash.blend"])
+    output_dir = tmp_path / "out"
+    manifest = tmp_path / "manifest.json"
+    exit_code = subprocess.call([sys.executable, DRIVER_PATH, "--blender", make_blender(tmp_path), "--jobs", "2",
+                                 "--output-dir", str(output_dir), "--manifest", str(manifest)] + testcases,
+                                cwd=ROOT, stdout=subprocess.DEVNULL)
+    assert exit_code == 1
+    with open(str(manifest)) as manifest_file:
+        statuses = dict((os.path.basename(result["file"]), result["status"]) for result in json.load(manifest_file))
+    assert statuses == {"ok.blend": "ok", "crash.blend": "failed"}
+
+
+def test_cleanup_keeps_other_files(tmp_path):
+    testcase, = make_testcases(tmp_path, ["ok.blend"])
+    # the output directory is the one the blend file and the stand-in for blender are in
+    blender = make_blender(tmp_path)
+    with open(str(tmp_path / "ok.blend.osg.log"), 'w') as old_log:
+        old_log.write("Traceback (most recent call last):\n")
+    exit_code = subprocess.call([sys.executable, DRIVER_PATH, "--blender", blender, "--output-dir", str(tmp_path), testcase],
+                                cwd=ROOT, stdout=subprocess.DEVNULL)
+    assert exit_code == 0
+    assert os.path.isfile(testcase)
+    assert os.path.isfile(blender)
+    with open(str(tmp_path / "ok.blend.osg.log")) as log:
+        assert "Traceback" not in log.read()
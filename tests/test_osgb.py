@@ -0,0 +1,76 @@
+# Tests of the native binary osgb output, with the fake bpy of the benchmarks.
+
+import io
+import os
+import sys
+import struct
+import contextlib
+import importlib.util
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench", "fake"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import scenes
+
+OBJECTS = 4
+DUPLICATES = 2
+
+
+def load_exporter():
+    spec = importlib.util.spec_from_file_location("io_export_osg", os.path.join(ROOT, "src", "io_export_osg.py"))
+    exporter = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(exporter)
+    return exporter
+
+
+def export_osgb(exporter, directory, **options):
+    # the file and the (class name, id) of every object it defines, in the order they were serialized
+    scenes.build_scene(objects=OBJECTS, vertices=400, materials=2, bones=4, keyframes=5, duplicates=DUPLICATES)
+    definitions = []
+    write_object = exporter.OSGBinaryEmitter.write_object
+
+    def record_write_object(emitter, block, *args):
+        key = (id(block),) + tuple(id(arg) for arg in args)
+        defined = key not in emitter.object_ids and key not in emitter.spooled
+        object_id = emitter.object_count + 1
+        write_object(emitter, block, *args)
+        if defined:
+            definitions.append((exporter.OSGB_WRITERS[block.class_name()][1], object_id))
+
+    exporter.OSGBinaryEmitter.write_object = record_write_object
+    path = os.path.join(str(directory), "scene.osgb")
+    with contextlib.redirect_stdout(io.StringIO()):
+        exporter.write_osg(None, path, True, False, True, option_format='OSGB', **options)
+    with open(path, 'rb') as model:
+        return model.read(), definitions
+
+
+def object_header(name, object_id):
+    data = name.encode("utf-8")
+    return struct.pack("<I", len(data)) + data + struct.pack("<I", object_id)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_osgb_objects(tmp_path, streaming):
+    exporter = load_exporter()
+    data, definitions = export_osgb(exporter, tmp_path, option_streaming=streaming)
+
+    header = struct.pack("<IIIII", exporter.OSGB_HEADER_LOW, exporter.OSGB_HEADER_HIGH, exporter.OSGB_READ_SCENE, exporter.OSGB_VERSION, 0)
+    assert data.startswith(header)
+    # the compressor string, "0" for none
+    assert data[len(header):len(header) + 5] == struct.pack("<I", 1) + b"0"
+
+    # every object has its own id, and every one of them is in the file
+    object_ids = [object_id for name, object_id in definitions]
+    assert len(set(object_ids)) == len(object_ids)
+    for name, object_id in definitions:
+        assert object_header(name, object_id) in data
+
+    # the duplicates share the Geode of their mesh, written once and referenced afterwards
+    geodes = [object_id for name, object_id in definitions if name == "osg::Geode"]
+    assert len(geodes) == OBJECTS
+    geode_headers = [data.count(object_header("osg::Geode", object_id)) for object_id in geodes]
+    assert sorted(geode_headers) == [1] * (OBJECTS - 1) + [1 + DUPLICATES]
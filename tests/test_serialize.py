@@ -0,0 +1,122 @@
+# Tests of the text emitter with serialization jobs, and of exports formatted in
+# serialization processes, with the fake bpy of the benchmarks.
+
+import io
+import os
+import sys
+import contextlib
+import multiprocessing
+import importlib.util
+import concurrent.futures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench", "fake"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import scenes
+
+
+def load_exporter():
+    spec = importlib.util.spec_from_file_location("io_export_osg", os.path.join(ROOT, "src", "io_export_osg.py"))
+    exporter = importlib.util.module_from_spec(spec)
+    # the serialization processes find their functions through the module name
+    sys.modules[spec.name] = exporter
+    spec.loader.exec_module(exporter)
+    return exporter
+
+
+class Output(object):
+    def __init__(self):
+        self.text = ""
+
+    def write(self, s):
+        self.text += s
+
+    def close(self):
+        pass
+
+
+class Job(concurrent.futures.Future):
+    '''A serialization job that is finished by the test, waiting for it finishes it at once'''
+
+    def __init__(self, text):
+        concurrent.futures.Future.__init__(self)
+        self.text = text
+        self.waited = False
+
+    def finish(self):
+        self.set_result(self.text)
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.waited = True
+            self.finish()
+        return concurrent.futures.Future.result(self)
+
+
+def test_running_jobs_overlap():
+    exporter = load_exporter()
+    output = Output()
+    emitter = exporter.OSGEmitter(output, 64)
+    first = Job("first\n")
+    second = Job("second\n")
+    emitter.write_indented("before")
+    emitter.write_deferred(first, 4)
+    emitter.write("a" * 40)
+    emitter.write_deferred(second, 4)
+    emitter.write("b" * 60)
+    # the buffer is full but neither job was waited for, only the text before the first one is written
+    assert not first.waited and not second.waited
+    assert output.text == "before\n"
+
+    first.finish()
+    emitter.write("c" * 10)
+    assert not second.waited
+    assert output.text == "before\nfirst\n" + "a" * 40
+
+    emitter.close()
+    assert output.text == "before\nfirst\n" + "a" * 40 + "second\n" + "b" * 60 + "c" * 10
+
+
+def test_jobs_in_flight_are_bounded():
+    exporter = load_exporter()
+    output = Output()
+    emitter = exporter.OSGEmitter(output)
+    jobs = [Job("%d\n" % i) for i in range(3)]
+    for job in jobs:
+        emitter.write_deferred(job, 2)
+    # the third job waits for the oldest one only
+    assert [job.waited for job in jobs] == [True, False, False]
+    assert output.text == "0\n"
+    emitter.close()
+    assert output.text == "0\n1\n2\n"
+
+
+def export_text(exporter, directory, **options):
+    scenes.build_scene(objects=4, vertices=10000, materials=2, bones=4, keyframes=5)
+    path = os.path.join(str(directory), "scene.osg")
+    with contextlib.redirect_stdout(io.StringIO()):
+        exporter.write_osg(None, path, True, False, True, **options)
+    with open(path) as model:
+        return model.read()
+
+
+def test_serialization_processes_write_the_same_text(tmp_path):
+    exporter = load_exporter()
+    serial = export_text(exporter, tmp_path)
+    assert export_text(exporter, tmp_path, option_serialize_workers=2) == serial
+    assert export_text(exporter, tmp_path, option_serialize_workers=2, option_incremental=True) == serial
+
+
+def test_one_core_without_start_methods(tmp_path, monkeypatch):
+    # python 3.2 of blender 2.5x can not fork a process pool
+    exporter = load_exporter()
+    serial = export_text(exporter, tmp_path)
+    monkeypatch.delattr(multiprocessing, "get_context")
+    monkeypatch.delattr(multiprocessing, "get_all_start_methods")
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        exporter.start_serialize_pool(2)
+    assert exporter.serialize_pool is None
+    assert "serializing on one core" in output.getvalue()
+    assert export_text(exporter, tmp_path, option_serialize_workers=2) == serial
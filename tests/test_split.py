@@ -0,0 +1,45 @@
+# Tests of the splitting of large drawables into chunks with 16 bit indices.
+
+import os
+import sys
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench", "fake"))
+
+
+def load_exporter():
+    spec = importlib.util.spec_from_file_location("io_export_osg", os.path.join(ROOT, "src", "io_export_osg.py"))
+    exporter = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(exporter)
+    return exporter
+
+
+def mixed_grid(n):
+    # a grid of n x n cells where every third cell is two triangles, the others are quads
+    tris = []
+    quads = []
+    for j in range(n):
+        for i in range(n):
+            a = j * (n + 1) + i
+            b, c, d = a + 1, a + n + 2, a + n + 1
+            if (i + j) % 3 == 0:
+                tris.append([a, b, c])
+                tris.append([a, c, d])
+            else:
+                quads.append([a, b, c, d])
+    return tris, quads, (n + 1) * (n + 1)
+
+
+def test_chunks_share_few_vertices():
+    exporter = load_exporter()
+    tris, quads, num_vertices = mixed_grid(40)
+    positions = [(index, 0.0, 0.0) for index in range(num_vertices)]
+    limit = 400
+    chunks = exporter.split_primitives(tris, quads, positions, positions, [], list(range(num_vertices)), limit)
+
+    assert sum([len(chunk_tris) for chunk_tris, chunk_quads, chunk_positions, chunk_normals, chunk_uvs in chunks]) == len(tris)
+    assert sum([len(chunk_quads) for chunk_tris, chunk_quads, chunk_positions, chunk_normals, chunk_uvs in chunks]) == len(quads)
+    assert max([len(chunk[2]) for chunk in chunks]) <= limit
+    # only the vertices on the borders between the chunks are written twice
+    assert sum([len(chunk[2]) for chunk in chunks]) < num_vertices * 1.2
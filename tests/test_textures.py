@@ -0,0 +1,50 @@
+# Tests of the texture pool, with the fake bpy of the benchmarks.
+
+import io
+import os
+import sys
+import contextlib
+import multiprocessing
+import importlib.util
+import concurrent.futures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench", "fake"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import scenes
+
+
+def load_exporter():
+    spec = importlib.util.spec_from_file_location("io_export_osg", os.path.join(ROOT, "src", "io_export_osg.py"))
+    exporter = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = exporter
+    spec.loader.exec_module(exporter)
+    return exporter
+
+
+def export(exporter, directory, textures):
+    scenes.build_scene(objects=2, vertices=100, materials=1, bones=0, keyframes=0, textures=textures)
+    path = os.path.join(str(directory), "scene.osg")
+    with contextlib.redirect_stdout(io.StringIO()):
+        exporter.write_osg(None, path, True, False, True)
+    return path
+
+
+def test_no_pool_without_textures(tmp_path):
+    exporter = load_exporter()
+    export(exporter, tmp_path, 0)
+    assert exporter.texture_pool is None
+
+
+def test_threads_encode_without_start_methods(tmp_path, monkeypatch):
+    # python 3.2 of blender 2.5x has neither NumPy nor the start methods of multiprocessing
+    monkeypatch.delattr(multiprocessing, "get_context")
+    monkeypatch.delattr(multiprocessing, "get_all_start_methods")
+    exporter = load_exporter()
+    exporter.numpy = None
+    path = export(exporter, tmp_path, 1)
+    assert isinstance(exporter.texture_pool, concurrent.futures.ThreadPoolExecutor)
+    assert os.path.getsize(os.path.join(str(tmp_path), "scene-image0.png")) > 0
+    with open(path) as model:
+        assert "scene-image0.png" in model.read()
@@ -0,0 +1,41 @@
+# Tests of the vertex welding of build_vertex_arrays, with and without NumPy.
+
+import os
+import sys
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench", "fake"))
+
+
+def load_exporter():
+    spec = importlib.util.spec_from_file_location("io_export_osg", os.path.join(ROOT, "src", "io_export_osg.py"))
+    exporter = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(exporter)
+    return exporter
+
+
+def coincident_triangles(exporter):
+    # two triangles, mesh vertex 3 lies on mesh vertex 0 with the same normal
+    coordinates = [0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0]
+    normals = [0, 0, 1] * 4
+    face_vertices = [0, 1, 2, 0, 3, 2, 1, 0]
+    arrays = [coordinates, normals, face_vertices, [3, 3], [0, 0]]
+    if exporter.numpy != None:
+        arrays = [exporter.numpy.array(values, dtype=exporter.numpy.int32 if index >= 2 else exporter.numpy.float32)
+                  for index, values in enumerate(arrays)]
+    return tuple(arrays) + (None,)
+
+
+def welded_sources(exporter, keep_sources):
+    positions, normals, uvs, vertex_sources, bucket_indices = exporter.build_vertex_arrays(
+        coincident_triangles(exporter), True, 0.0001, keep_sources)
+    return sorted(exporter.as_list(vertex_sources))
+
+
+def test_weld_keeps_the_vertices_of_a_rig():
+    exporter = load_exporter()
+    for numpy in (exporter.numpy, None):
+        exporter.numpy = numpy
+        assert welded_sources(exporter, False) == [0, 1, 2]
+        assert welded_sources(exporter, True) == [0, 1, 2, 3]